@@ -1,5 +1,6 @@
 from fastapi import APIRouter
-from app.api import brands, balances, transactions, provisions, customers
+from app.core.config import settings
+from app.api import brands, balances, transactions, provisions, customers, exports
 
 api_router = APIRouter()
 
@@ -8,3 +9,9 @@ api_router.include_router(customers.router, tags=["customers"])
 api_router.include_router(balances.router, tags=["balances"])
 api_router.include_router(transactions.router, tags=["transactions"])
 api_router.include_router(provisions.router, tags=["provisions"])
+api_router.include_router(exports.router, tags=["exports"])
+
+if settings.PROFILER_ENABLED:
+    from app.api import profiles
+
+    api_router.include_router(profiles.router, prefix="/admin", tags=["admin"])
@@ -1,31 +1,35 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from app.db.session import get_db
+from app.db.session import get_read_session, run_db, AnySession
 from app.core.crud import BalanceCRUD, BrandCustomerCRUD, BrandCRUD
+from app.core.responses import fast_response
 
 router = APIRouter()
 
 
 @router.get("/brands/{brand_id}/customers/{customer_id}/balance")
-def get_balance(brand_id: str, customer_id: str, db: Session = Depends(get_db)):
+async def get_balance(brand_id: str, customer_id: str, db: AnySession = Depends(get_read_session)):
     """Get balance for a customer at a specific brand using brand's customer ID"""
+    return fast_response(await run_db(db, _get_balance, brand_id, customer_id))
+
+
+def _get_balance(db: Session, brand_id: str, customer_id: str) -> dict:
     # Validate brand exists
     brand = BrandCRUD.get_by_id(db, brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
 
-    # Get customer by brand customer ID
-    brand_customer = BrandCustomerCRUD.get_by_brand_customer_id(db, brand_id, customer_id)
-    if not brand_customer:
+    # Get customer's phone number by brand customer ID
+    phone_number = BrandCustomerCRUD.get_phone_number(db, brand_id, customer_id)
+    if phone_number is None:
         raise HTTPException(status_code=404, detail=f"Customer '{customer_id}' not found for this brand")
 
-    phone_number = brand_customer.phone_number
     # Use brandCustomerId as user_id to match transactions
-    balance = BalanceCRUD.get_or_create(db, brand_id, customer_id)
+    balance = BalanceCRUD.get_points(db, brand_id, customer_id)
 
     return {
-        "brandId": balance.brand_id,
+        "brandId": brand_id,
         "customerId": customer_id,
         "phoneNumber": phone_number,
         "points": balance.points,
@@ -1,10 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
-from typing import List
-
-from app.db.session import get_db
-from app.core.crud import BrandCustomerCRUD, BalanceCRUD, BrandCRUD
-from app.schemas import BrandCustomerCreate, BrandCustomerDetail
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Iterator
+import base64
+import binascii
+import io
+import json
+
+from app.db.session import get_db, get_read_db
+from app.core.crud import BrandCustomerCRUD, BalanceCRUD, BrandCRUD, unit_of_work
+from app.core.customer_import import ImportFormat, import_customers as bulk_import_customers, parse_rows
+from app.core.responses import fast_response
+from app.schemas import BrandCustomerCreate, BrandCustomerDetail, BRAND_CUSTOMER_DETAIL, BRAND_CUSTOMER_DETAILS
 
 router = APIRouter()
 
@@ -16,69 +25,138 @@ def register_customer(
     db: Session = Depends(get_db)
 ):
     """Register a customer to a brand with brand-specific customer ID"""
+    with unit_of_work(db):
+        # Validate brand exists
+        brand = BrandCRUD.get_by_id(db, brand_id)
+        if not brand:
+            raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+
+        # Check if customer already registered with this brand
+        existing = BrandCustomerCRUD.get_by_phone(db, brand_id, body.phoneNumber)
+        if existing:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Customer with phone {body.phoneNumber} already registered to this brand"
+            )
+
+        # Check if brand customer ID already used
+        existing_id = BrandCustomerCRUD.get_by_brand_customer_id(db, brand_id, body.brandCustomerId)
+        if existing_id:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Brand customer ID '{body.brandCustomerId}' already exists"
+            )
+
+        # Create brand-customer relationship
+        brand_customer = BrandCustomerCRUD.create(db, brand_id, body.phoneNumber, body.brandCustomerId)
+
+        # Get or create balance for this customer (using brandCustomerId as user_id)
+        balance = BalanceCRUD.get_or_create(db, brand_id, body.brandCustomerId)
+
+        return fast_response({
+            "phoneNumber": brand_customer.phone_number,
+            "brandCustomerId": brand_customer.brand_customer_id,
+            "points": balance.points,
+            # The in-memory value is timezone-aware; match the naive form read back by get_customer
+            "createdAt": brand_customer.created_at.replace(tzinfo=None).isoformat()
+        }, BRAND_CUSTOMER_DETAIL, status_code=201)
+
 
+@router.post("/brands/{brand_id}/customers/import")
+async def import_customers(
+    brand_id: str,
+    request: Request,
+    format: ImportFormat = Query("csv", description="Format of the request body"),
+    db: Session = Depends(get_db)
+):
+    """Register many customers from a CSV or NDJSON request body
+
+    Records have phoneNumber, brandCustomerId and optional initialPoints.
+    Valid new customers are imported in chunks; every other record is
+    listed in `rejects` with its line number and reason.
+    """
+    body = await request.body()
+    return await run_in_threadpool(_import_customers, db, brand_id, body, format)
+
+
+def _import_customers(db: Session, brand_id: str, body: bytes, fmt: ImportFormat) -> dict:
     # Validate brand exists
     brand = BrandCRUD.get_by_id(db, brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
 
-    # Check if customer already registered with this brand
-    existing = BrandCustomerCRUD.get_by_phone(db, brand_id, body.phoneNumber)
-    if existing:
-        raise HTTPException(
-            status_code=409,
-            detail=f"Customer with phone {body.phoneNumber} already registered to this brand"
-        )
-
-    # Check if brand customer ID already used
-    existing_id = BrandCustomerCRUD.get_by_brand_customer_id(db, brand_id, body.brandCustomerId)
-    if existing_id:
-        raise HTTPException(
-            status_code=409,
-            detail=f"Brand customer ID '{body.brandCustomerId}' already exists"
-        )
-
-    # Create brand-customer relationship
-    brand_customer = BrandCustomerCRUD.create(db, brand_id, body.phoneNumber, body.brandCustomerId)
-
-    # Get or create balance for this customer (using brandCustomerId as user_id)
-    balance = BalanceCRUD.get_or_create(db, brand_id, body.brandCustomerId)
-
-    return {
-        "phoneNumber": brand_customer.phone_number,
-        "brandCustomerId": brand_customer.brand_customer_id,
-        "points": balance.points,
-        "createdAt": brand_customer.created_at.isoformat()
-    }
+    try:
+        lines = io.StringIO(body.decode("utf-8-sig"))
+        return bulk_import_customers(db, brand_id, parse_rows(lines, fmt))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Request body must be UTF-8")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
 
 @router.get("/brands/{brand_id}/customers", response_model=List[BrandCustomerDetail])
-def list_customers(brand_id: str, db: Session = Depends(get_db)):
-    """List all customers of a brand with their details"""
+def list_customers(
+    brand_id: str,
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's X-Next-Cursor header"),
+    limit: int = Query(100, ge=1, le=1000),
+    stream: bool = Query(False, description="Stream every customer as NDJSON instead of paging"),
+    db: Session = Depends(get_read_db)
+):
+    """List customers of a brand with their details, ordered by brand customer ID
+
+    Pages are keyset-paginated: pass the `X-Next-Cursor` response header as
+    `cursor` to fetch the next page. With `stream=true` all remaining
+    customers are streamed as NDJSON.
+    """
+    after = _decode_cursor(cursor) if cursor is not None else None
 
     # Validate brand exists
     brand = BrandCRUD.get_by_id(db, brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
 
-    brand_customers = BrandCustomerCRUD.list_by_brand(db, brand_id)
+    if stream:
+        return StreamingResponse(_stream_customers(db.get_bind(), brand_id, after), media_type="application/x-ndjson")
+
+    rows = BrandCustomerCRUD.page_with_points(db, brand_id, after, limit)
+    headers = {"X-Next-Cursor": _encode_cursor(rows[-1].brand_customer_id)} if len(rows) == limit else None
+
+    return fast_response([_customer_detail(row) for row in rows], BRAND_CUSTOMER_DETAILS, headers=headers)
+
+
+def _encode_cursor(brand_customer_id: str) -> str:
+    """Base64 so any brand customer ID fits in a (latin-1) response header"""
+    return base64.urlsafe_b64encode(brand_customer_id.encode()).decode()
 
-    results = []
-    for bc in brand_customers:
-        # Get balance for each customer (using brandCustomerId as user_id)
-        balance = BalanceCRUD.get_or_create(db, brand_id, bc.brand_customer_id)
-        results.append({
-            "phoneNumber": bc.phone_number,
-            "brandCustomerId": bc.brand_customer_id,
-            "points": balance.points,
-            "createdAt": bc.created_at.isoformat()
-        })
 
-    return results
+def _decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _customer_detail(row) -> dict:
+    return {
+        "phoneNumber": row.phone_number,
+        "brandCustomerId": row.brand_customer_id,
+        "points": row.points,
+        "createdAt": row.created_at.isoformat()
+    }
+
+
+def _stream_customers(bind: Engine, brand_id: str, after: Optional[str]) -> Iterator[str]:
+    """Yield NDJSON lines; uses its own session (on the request's engine) because it outlives the handler"""
+    db = Session(bind=bind)
+    try:
+        for row in BrandCustomerCRUD.stream_with_points(db, brand_id, after):
+            yield json.dumps(_customer_detail(row), ensure_ascii=False) + "\n"
+    finally:
+        db.close()
 
 
 @router.get("/brands/{brand_id}/customers/{brand_customer_id}", response_model=BrandCustomerDetail)
-def get_customer(brand_id: str, brand_customer_id: str, db: Session = Depends(get_db)):
+def get_customer(brand_id: str, brand_customer_id: str, db: Session = Depends(get_read_db)):
     """Get a specific customer by their brand-specific customer ID"""
 
     # Validate brand exists
@@ -90,18 +168,18 @@ def get_customer(brand_id: str, brand_customer_id: str, db: Session = Depends(ge
     if not brand_customer:
         raise HTTPException(status_code=404, detail="Customer not found")
 
-    balance = BalanceCRUD.get_or_create(db, brand_id, brand_customer.brand_customer_id)
+    balance = BalanceCRUD.get_points(db, brand_id, brand_customer.brand_customer_id)
 
-    return {
+    return fast_response({
         "phoneNumber": brand_customer.phone_number,
         "brandCustomerId": brand_customer.brand_customer_id,
         "points": balance.points,
         "createdAt": brand_customer.created_at.isoformat()
-    }
+    }, BRAND_CUSTOMER_DETAIL)
 
 
 @router.get("/brands/{brand_id}/customers/by-phone/{phone_number}", response_model=BrandCustomerDetail)
-def get_customer_by_phone(brand_id: str, phone_number: str, db: Session = Depends(get_db)):
+def get_customer_by_phone(brand_id: str, phone_number: str, db: Session = Depends(get_read_db)):
     """Check if a customer with given phone number is registered with the brand"""
 
     # Validate brand exists
@@ -121,11 +199,11 @@ def get_customer_by_phone(brand_id: str, phone_number: str, db: Session = Depend
             detail=f"Customer with phone {phone_number} is not registered with this brand"
         )
 
-    balance = BalanceCRUD.get_or_create(db, brand_id, brand_customer.brand_customer_id)
+    balance = BalanceCRUD.get_points(db, brand_id, brand_customer.brand_customer_id)
 
-    return {
+    return fast_response({
         "phoneNumber": brand_customer.phone_number,
         "brandCustomerId": brand_customer.brand_customer_id,
         "points": balance.points,
         "createdAt": brand_customer.created_at.isoformat()
-    }
+    }, BRAND_CUSTOMER_DETAIL)
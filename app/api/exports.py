@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.db.session import get_db
+from app.core.crud import BrandCRUD
+from app.core.export import ExportDataset, ExportFormat, export_stream
+
+router = APIRouter()
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@router.get("/brands/{brand_id}/export/{dataset}")
+def export_brand_data(
+    brand_id: str,
+    dataset: ExportDataset,
+    format: ExportFormat = Query("ndjson"),
+    since: Optional[datetime] = Query(None, description="Transactions only: at or after this time"),
+    until: Optional[datetime] = Query(None, description="Transactions only: before this time"),
+    cursor: Optional[str] = Query(None, description="Resume after this seq (transactions) or customerId (balances)"),
+    gzip: bool = Query(False, description="Gzip-compress the download"),
+    db: Session = Depends(get_db)
+):
+    """Stream all of a brand's transactions or balances as CSV or NDJSON"""
+
+    # Validate brand exists
+    brand = BrandCRUD.get_by_id(db, brand_id)
+    if not brand:
+        raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+
+    if dataset == "transactions" and cursor is not None and not cursor.isdigit():
+        raise HTTPException(status_code=400, detail="Transaction export cursor must be a seq number")
+
+    # Compare against created_at, which is stored in UTC; naive times are taken as UTC
+    if since is not None:
+        since = since.astimezone(timezone.utc) if since.tzinfo else since.replace(tzinfo=timezone.utc)
+    if until is not None:
+        until = until.astimezone(timezone.utc) if until.tzinfo else until.replace(tzinfo=timezone.utc)
+
+    filename = f"{brand_id}-{dataset}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_stream(dataset, brand_id, format, cursor, since, until, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from app.core.profiler import is_authorized, sampler
+
+router = APIRouter()
+
+
+def require_profiler_token(x_profile: Optional[str] = Header(None)) -> None:
+    """Admin endpoints take the PROFILER_TOKEN in the X-Profile header"""
+    if not is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Profile token")
+
+
+@router.get("/profiles", response_class=PlainTextResponse, dependencies=[Depends(require_profiler_token)])
+def get_profiles(route: Optional[str] = Query(None, description='Only this route, e.g. "POST /brands/{brand_id}/redeem"')):
+    """Sampled stacks of profiled requests in collapsed-stack format (input for flamegraph.pl / speedscope)"""
+    return PlainTextResponse(sampler.render(route))
+
+
+@router.delete("/profiles", status_code=204, dependencies=[Depends(require_profiler_token)])
+def reset_profiles():
+    """Discard the collected samples"""
+    sampler.reset()
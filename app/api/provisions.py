@@ -1,76 +1,116 @@
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+
+from fastapi import APIRouter, Depends, Header, HTTPException
 from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone
+from typing import Optional
 
-from app.db.session import get_db
-from app.core.crud import BalanceCRUD, ProvisionCRUD, BrandCustomerCRUD, BrandCRUD
+from app.db.session import get_read_session, get_session, run_db, AnySession
+from app.core.crud import BalanceCRUD, ProvisionCRUD, BrandCustomerCRUD, BrandCRUD, OutboxCRUD, unit_of_work
+from app.core.idempotency import IdempotentRequest, record_response, run_idempotent
+from app.core.responses import fast_response
 from app.schemas import ProvisionRequest
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
 @router.post("/brands/{brand_id}/provision")
-def create_provision(brand_id: str, body: ProvisionRequest, db: Session = Depends(get_db)):
+async def create_provision(
+    brand_id: str,
+    body: ProvisionRequest,
+    idempotency_key: Optional[str] = Header(None),
+    db: AnySession = Depends(get_session)
+):
     """Create a provision (reserve and lock points for later redemption) using brand's customer ID"""
-    # Validate brand exists
-    brand = BrandCRUD.get_by_id(db, brand_id)
-    if not brand:
-        raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
-
-    # Check if provision ID already exists
-    existing_provision = ProvisionCRUD.get_by_id(db, body.provisionId)
-    if existing_provision:
-        raise HTTPException(status_code=409, detail=f"Provision ID '{body.provisionId}' already exists")
-
-    # Get customer by brand customer ID
-    brand_customer = BrandCustomerCRUD.get_by_brand_customer_id(db, brand_id, body.customerId)
-    if not brand_customer:
-        raise HTTPException(status_code=404, detail=f"Customer '{body.customerId}' not found for this brand")
-
-    phone_number = brand_customer.phone_number
-
-    # Get current balance (using brandCustomerId as user_id)
-    balance = BalanceCRUD.get_or_create(db, brand_id, body.customerId)
-
-    if balance.points < body.points:
-        raise HTTPException(status_code=400, detail="Insufficient points to provision")
-
-    # LOCK POINTS: Deduct points from balance when provisioning
-    balance = BalanceCRUD.update_points(db, balance, -body.points)
-
-    # Ensure expiresAt has timezone info
-    expires_at = body.expiresAt
-    if expires_at.tzinfo is None:
-        # If naive datetime, assume UTC
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-
-    # Create provision (using brandCustomerId as user_id)
-    ProvisionCRUD.create(db, body.provisionId, brand_id, body.customerId, body.points, expires_at)
-
-    return {
-        "status": "provisioned",
-        "provisionId": body.provisionId,
-        "customerId": body.customerId,
-        "phoneNumber": phone_number,
-        "provisionedPoints": body.points,
-        "remainingBalance": balance.points,
-        "expiresAt": body.expiresAt.isoformat()
-    }
+    return fast_response(
+        await run_idempotent(db, brand_id, idempotency_key, "provision", body, _create_provision, brand_id, body)
+    )
+
+
+def _create_provision(db: Session, brand_id: str, body: ProvisionRequest,
+                      idempotent: Optional[IdempotentRequest]) -> dict:
+    with unit_of_work(db):
+        # Validate brand exists
+        brand = BrandCRUD.get_by_id(db, brand_id)
+        if not brand:
+            raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+
+        # Check if provision ID already exists
+        existing_provision = ProvisionCRUD.get_by_id(db, body.provisionId)
+        if existing_provision:
+            raise HTTPException(status_code=409, detail=f"Provision ID '{body.provisionId}' already exists")
+
+        # Get customer's phone number by brand customer ID
+        phone_number = BrandCustomerCRUD.get_phone_number(db, brand_id, body.customerId)
+        if phone_number is None:
+            raise HTTPException(status_code=404, detail=f"Customer '{body.customerId}' not found for this brand")
+
+        # LOCK POINTS: Deduct points from balance when provisioning, only if
+        # the balance covers them (using brandCustomerId as user_id)
+        balance = BalanceCRUD.deduct_points(db, brand_id, body.customerId, body.points)
+        if balance is None:
+            raise HTTPException(status_code=400, detail="Insufficient points to provision")
+
+        # Ensure expiresAt has timezone info and is stored in UTC, so the
+        # expiry sweeper can compare it against the current UTC time
+        expires_at = body.expiresAt
+        if expires_at.tzinfo is None:
+            # If naive datetime, assume UTC
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        expires_at = expires_at.astimezone(timezone.utc)
+
+        # Create provision (using brandCustomerId as user_id); a concurrent
+        # request may have used the same provision ID since the check above
+        try:
+            ProvisionCRUD.create(db, body.provisionId, brand_id, body.customerId, body.points, expires_at)
+        except IntegrityError:
+            raise HTTPException(status_code=409, detail=f"Provision ID '{body.provisionId}' already exists")
+
+        # Queue the webhook event in the same transaction
+        OutboxCRUD.add(db, brand_id, "provisioned", {
+            "provisionId": body.provisionId,
+            "customerId": body.customerId,
+            "points": -body.points,
+            "balance": balance.points,
+            "expiresAt": expires_at.isoformat()
+        })
+
+        return record_response(db, idempotent, {
+            "status": "provisioned",
+            "provisionId": body.provisionId,
+            "customerId": body.customerId,
+            "phoneNumber": phone_number,
+            "provisionedPoints": body.points,
+            "remainingBalance": balance.points,
+            "expiresAt": body.expiresAt.isoformat()
+        })
 
 
 @router.get("/provisions/{provision_id}")
-def check_provision(provision_id: str, db: Session = Depends(get_db)):
+async def check_provision(provision_id: str, db: AnySession = Depends(get_read_session)):
     """Check status of a provision"""
+    return fast_response(await run_db(db, _check_provision, provision_id))
+
+
+def _check_provision(db: Session, provision_id: str):
     provision = ProvisionCRUD.get_by_id(db, provision_id)
     if not provision:
         raise HTTPException(status_code=404, detail="Provision not found")
 
     now = datetime.now(timezone.utc)
-    if now > provision.expires_at:
+    # Ensure provision expires_at is timezone-aware for comparison
+    expires_at = provision.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if now > expires_at or provision.status != "active":
         return JSONResponse(
             status_code=410,
-            content={"status": "expired", "provisionId": provision_id}
+            content={"status": "redeemed" if provision.status == "redeemed" else "expired",
+                     "provisionId": provision_id}
         )
 
     return {
@@ -87,5 +127,5 @@ def check_provision(provision_id: str, db: Session = Depends(get_db)):
 def webhook(event: dict):
     """Webhook endpoint for loyalty events"""
     # In real implementation, verify and process the webhook
-    print("Received webhook:", event)
+    logger.debug("Received webhook: %s", event)
     return
@@ -1,143 +1,388 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+import base64
+import binascii
 
-from app.db.session import get_db
-from app.core.crud import BalanceCRUD, TransactionCRUD, ProvisionCRUD, BrandCustomerCRUD, BrandCRUD
-from app.schemas import EarnRequest, RedeemRequest, VoidRequest
+from app.db.session import get_read_session, get_session, run_db, AnySession
+from app.db.group_commit import run_write
+from app.core.crud import (BalanceCRUD, TransactionCRUD, ProvisionCRUD, BrandCustomerCRUD, BrandCRUD, OutboxCRUD,
+                           unit_of_work)
+from app.core.idempotency import IdempotentRequest, record_response, run_idempotent
+from app.core.responses import fast_response
+from app.schemas import (EarnRequest, EarnBatchRequest, RedeemRequest, VoidRequest, TransactionResponse,
+                         TransactionHistoryItem, TRANSACTION_RESPONSE, TRANSACTION_HISTORY)
 
 router = APIRouter()
 
 
-@router.post("/brands/{brand_id}/earn")
-def earn_points(brand_id: str, body: EarnRequest, db: Session = Depends(get_db)):
+@router.post("/brands/{brand_id}/earn", response_model=TransactionResponse)
+async def earn_points(
+    brand_id: str,
+    body: EarnRequest,
+    idempotency_key: Optional[str] = Header(None),
+    db: AnySession = Depends(get_session)
+):
     """Add points to a customer's balance using brand's customer ID"""
-    # Validate brand exists
-    brand = BrandCRUD.get_by_id(db, brand_id)
-    if not brand:
-        raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+    return fast_response(
+        await run_idempotent(db, brand_id, idempotency_key, "earn", body, _earn_points, brand_id, body),
+        TRANSACTION_RESPONSE
+    )
+
+
+def _earn_points(db: Session, brand_id: str, body: EarnRequest,
+                 idempotent: Optional[IdempotentRequest]) -> dict:
+    with unit_of_work(db):
+        # Validate brand exists
+        brand = BrandCRUD.get_by_id(db, brand_id)
+        if not brand:
+            raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+
+        # Get customer's phone number by brand customer ID
+        phone_number = BrandCustomerCRUD.get_phone_number(db, brand_id, body.customerId)
+        if phone_number is None:
+            raise HTTPException(status_code=404, detail=f"Customer '{body.customerId}' not found for this brand")
 
-    # Get customer by brand customer ID
-    brand_customer = BrandCustomerCRUD.get_by_brand_customer_id(db, brand_id, body.customerId)
-    if not brand_customer:
-        raise HTTPException(status_code=404, detail=f"Customer '{body.customerId}' not found for this brand")
+        # Check if transaction already exists for this brand
+        if TransactionCRUD.get_by_id(db, brand_id, body.txnId):
+            raise HTTPException(status_code=409, detail=f"Transaction ID '{body.txnId}' already used for this brand")
 
-    # Check if transaction already exists for this brand
-    if TransactionCRUD.get_by_id(db, brand_id, body.txnId):
-        raise HTTPException(status_code=409, detail=f"Transaction ID '{body.txnId}' already used for this brand")
+        # Atomically update balance (using brandCustomerId as user_id)
+        balance = BalanceCRUD.increment(db, brand_id, body.customerId, body.points)
 
-    phone_number = brand_customer.phone_number
+        # Create transaction record (using brandCustomerId as user_id); a concurrent
+        # request may have used the same txnId since the check above
+        try:
+            TransactionCRUD.create(db, body.txnId, brand_id, body.customerId, body.points)
+        except IntegrityError:
+            raise HTTPException(status_code=409, detail=f"Transaction ID '{body.txnId}' already used for this brand")
 
-    # Get or create balance (using brandCustomerId as user_id)
-    balance = BalanceCRUD.get_or_create(db, brand_id, body.customerId)
+        # Queue the webhook event in the same transaction
+        OutboxCRUD.add(db, brand_id, "earned", {
+            "txnId": body.txnId,
+            "customerId": body.customerId,
+            "points": body.points,
+            "balance": balance.points
+        })
 
-    # Update balance
-    balance = BalanceCRUD.update_points(db, balance, body.points)
+        return record_response(db, idempotent, {
+            "status": "earned",
+            "txnId": body.txnId,
+            "brandId": brand_id,
+            "customerId": body.customerId,
+            "phoneNumber": phone_number,
+            "points": balance.points,
+            "updatedAt": balance.updated_at.isoformat()
+        })
+
+
+@router.post("/brands/{brand_id}/earn/batch")
+async def earn_points_batch(brand_id: str, body: EarnBatchRequest, db: AnySession = Depends(get_session)):
+    """Add points for many earn events at once (e.g. POS end-of-day uploads)"""
+    return fast_response(await run_write(db, _earn_points_batch, brand_id, body))
+
+
+def _earn_points_batch(db: Session, brand_id: str, body: EarnBatchRequest) -> dict:
+    with unit_of_work(db):
+        # Validate brand exists
+        brand = BrandCRUD.get_by_id(db, brand_id)
+        if not brand:
+            raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+
+        # Resolve customers and already-used transaction IDs with set-based lookups
+        phones = BrandCustomerCRUD.get_many_by_brand_customer_ids(
+            db, brand_id, (item.customerId for item in body.items)
+        )
+        used_txn_ids = TransactionCRUD.get_existing_txn_ids(
+            db, brand_id, (item.txnId for item in body.items)
+        )
 
-    # Create transaction record (using brandCustomerId as user_id)
-    TransactionCRUD.create(db, body.txnId, brand_id, body.customerId, body.points)
+        # Insert the ledger first and credit balances (set-based) in a savepoint; if a
+        # concurrent request used one of the txnIds since the lookup above, re-check and
+        # retry once so those items are reported as duplicates
+        for attempt in range(2):
+            results, accepted, deltas = _classify_batch(body, phones, used_txn_ids)
+            try:
+                with db.begin_nested():
+                    TransactionCRUD.bulk_create(db, brand_id, accepted)
+                    balances = BalanceCRUD.bulk_increment(db, brand_id, deltas)
+                break
+            except IntegrityError:
+                if attempt:
+                    raise HTTPException(status_code=409, detail="Transaction IDs in this batch were used concurrently")
+                used_txn_ids = TransactionCRUD.get_existing_txn_ids(
+                    db, brand_id, (item.txnId for item in body.items)
+                )
+        running = {user_id: balances[user_id] - delta for user_id, delta in deltas.items()}
 
-    return {
-        "status": "earned",
-        "txnId": body.txnId,
-        "brandId": brand_id,
-        "customerId": body.customerId,
-        "phoneNumber": phone_number,
-        "points": balance.points,
-        "updatedAt": balance.updated_at.isoformat()
-    }
+        # Report the balance each earned item produced, in request order
+        events = []
+        for item, result in zip(body.items, results):
+            if result["status"] == "earned":
+                running[item.customerId] += item.points
+                result["phoneNumber"] = phones[item.customerId]
+                result["points"] = running[item.customerId]
+                events.append({
+                    "txnId": item.txnId,
+                    "customerId": item.customerId,
+                    "points": item.points,
+                    "balance": result["points"]
+                })
+
+        # Queue the webhook events in the same transaction
+        OutboxCRUD.add_many(db, brand_id, "earned", events)
+
+        return {
+            "brandId": brand_id,
+            "earned": len(accepted),
+            "duplicates": sum(1 for r in results if r["status"] == "duplicate"),
+            "unknownCustomers": sum(1 for r in results if r["status"] == "unknown_customer"),
+            "results": results
+        }
+
+
+def _classify_batch(body: EarnBatchRequest, phones: Dict[str, str],
+                    used_txn_ids: Set[str]) -> Tuple[List[dict], List[dict], Dict[str, int]]:
+    """Per-item results, ledger rows to insert and points per customer
+
+    A txnId repeated inside the batch counts as a duplicate.
+    """
+    used_txn_ids = set(used_txn_ids)
+    results = []
+    accepted = []
+    deltas: Dict[str, int] = {}
+    for item in body.items:
+        if item.customerId not in phones:
+            status = "unknown_customer"
+        elif item.txnId in used_txn_ids:
+            status = "duplicate"
+        else:
+            status = "earned"
+            used_txn_ids.add(item.txnId)
+            accepted.append({"txn_id": item.txnId, "user_id": item.customerId, "points": item.points})
+            deltas[item.customerId] = deltas.get(item.customerId, 0) + item.points
+        results.append({"status": status, "txnId": item.txnId, "customerId": item.customerId})
+    return results, accepted, deltas
 
 
 @router.post("/brands/{brand_id}/redeem")
-def redeem_points(brand_id: str, body: RedeemRequest, db: Session = Depends(get_db)):
+async def redeem_points(
+    brand_id: str,
+    body: RedeemRequest,
+    idempotency_key: Optional[str] = Header(None),
+    db: AnySession = Depends(get_session)
+):
     """Redeem points from a customer's balance using brand's customer ID"""
+    return fast_response(
+        await run_idempotent(db, brand_id, idempotency_key, "redeem", body, _redeem_points, brand_id, body)
+    )
+
+
+def _redeem_points(db: Session, brand_id: str, body: RedeemRequest,
+                   idempotent: Optional[IdempotentRequest]) -> dict:
+    with unit_of_work(db):
+        # Validate brand exists
+        brand = BrandCRUD.get_by_id(db, brand_id)
+        if not brand:
+            raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
+
+        # Get customer's phone number by brand customer ID
+        phone_number = BrandCustomerCRUD.get_phone_number(db, brand_id, body.customerId)
+        if phone_number is None:
+            raise HTTPException(status_code=404, detail=f"Customer '{body.customerId}' not found for this brand")
+
+        # Check if transaction already exists for this brand
+        if TransactionCRUD.get_by_id(db, brand_id, body.txnId):
+            raise HTTPException(status_code=409, detail=f"Transaction ID '{body.txnId}' already used for this brand")
+
+        # Get provision
+        provision = ProvisionCRUD.get_by_id(db, body.provisionId)
+        if not provision:
+            raise HTTPException(status_code=404, detail="Provision not found")
+
+        # Check if expired (or already reclaimed by the sweeper)
+        now = datetime.now(timezone.utc)
+        # Ensure provision expires_at is timezone-aware for comparison
+        expires_at = provision.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if now > expires_at or provision.status == "expired":
+            raise HTTPException(status_code=410, detail="Provision expired")
+
+        # Validate provision matches user and brand (using brandCustomerId)
+        if provision.user_id != body.customerId or provision.brand_id != brand_id:
+            raise HTTPException(status_code=400, detail="Provision details mismatch")
+
+        # Check if provision has enough remaining points for this redemption
+        if provision.remaining_points < body.points:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient provisioned points. Requested: {body.points}, Available: {provision.remaining_points}"
+            )
+
+        # Points are already locked in provision, don't deduct from balance again
+        # Just update the provision's remaining points (kept as "redeemed" once fully used)
+        provision = ProvisionCRUD.update_remaining_points(db, provision, body.points)
+
+        # Create transaction record (using brandCustomerId as user_id); a concurrent
+        # request may have used the same txnId since the check above
+        try:
+            TransactionCRUD.create(db, body.txnId, brand_id, body.customerId, -body.points, kind="redeem")
+        except IntegrityError:
+            raise HTTPException(status_code=409, detail=f"Transaction ID '{body.txnId}' already used for this brand")
+
+        provision_status = "fully_redeemed" if provision.remaining_points == 0 else "partially_redeemed"
+
+        # Get updated balance (using brandCustomerId as user_id)
+        balance = BalanceCRUD.get_points(db, brand_id, body.customerId)
+
+        # Queue the webhook event in the same transaction
+        OutboxCRUD.add(db, brand_id, "redeemed", {
+            "txnId": body.txnId,
+            "customerId": body.customerId,
+            "provisionId": body.provisionId,
+            "points": -body.points,
+            "balance": balance.points
+        })
+
+        return record_response(db, idempotent, {
+            "status": "redeemed",
+            "txnId": body.txnId,
+            "brandId": brand_id,
+            "customerId": body.customerId,
+            "phoneNumber": phone_number,
+            "redeemedPoints": body.points,
+            "provisionStatus": provision_status,
+            "remainingProvisionPoints": provision.remaining_points if provision.remaining_points > 0 else 0,
+            "currentBalance": balance.points,
+            "updatedAt": balance.updated_at.isoformat()
+        })
+
+
+@router.post("/brands/{brand_id}/void")
+async def void_transaction(
+    brand_id: str,
+    body: VoidRequest,
+    idempotency_key: Optional[str] = Header(None),
+    db: AnySession = Depends(get_session)
+):
+    """Void/reverse a transaction"""
+    return fast_response(
+        await run_idempotent(db, brand_id, idempotency_key, "void", body, _void_transaction, brand_id, body)
+    )
+
+
+def _void_transaction(db: Session, brand_id: str, body: VoidRequest,
+                      idempotent: Optional[IdempotentRequest]) -> dict:
+    with unit_of_work(db):
+        # Get transaction for this brand
+        txn = TransactionCRUD.get_by_id(db, brand_id, body.txnId)
+        if not txn:
+            raise HTTPException(status_code=404, detail=f"Transaction '{body.txnId}' not found for this brand")
+        if txn.kind == "void":
+            raise HTTPException(status_code=400, detail="A void cannot be voided")
+
+        # Check if already voided
+        if TransactionCRUD.get_void(db, brand_id, txn.txn_id):
+            raise HTTPException(status_code=409, detail=f"Transaction '{body.txnId}' already voided")
+
+        # Reverse the points
+        balance = BalanceCRUD.increment(db, txn.brand_id, txn.user_id, -txn.points)
+
+        # Append a compensating entry linked to the original; the ledger is
+        # never modified. A concurrent void may have committed since the check above
+        try:
+            TransactionCRUD.create_void(db, txn)
+        except IntegrityError:
+            raise HTTPException(status_code=409, detail=f"Transaction '{body.txnId}' already voided")
+
+        # Queue the webhook event in the same transaction
+        OutboxCRUD.add(db, brand_id, "voided", {
+            "txnId": body.txnId,
+            "customerId": txn.user_id,
+            "points": -txn.points,
+            "balance": balance.points
+        })
+
+        return record_response(db, idempotent, {
+            "voided": True,
+            "txnId": body.txnId,
+            "status": "reversed"
+        })
+
+
+@router.get(
+    "/brands/{brand_id}/customers/{customer_id}/transactions",
+    response_model=List[TransactionHistoryItem]
+)
+async def list_customer_transactions(
+    brand_id: str,
+    customer_id: str,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
+    since: Optional[datetime] = Query(None, description="Only transactions at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only transactions before this time"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AnySession = Depends(get_read_session)
+):
+    """List a customer's transactions, newest first
+
+    Pages are keyset-paginated: pass the `X-Next-Cursor` response header as
+    `cursor` to fetch the next page, with the same filters.
+    """
+    after = _decode_cursor(cursor) if cursor is not None else None
+    rows = await run_db(
+        db, _list_customer_transactions, brand_id, customer_id, limit, after, _to_utc(since), _to_utc(until)
+    )
+    headers = None
+    if len(rows) == limit:
+        headers = {"X-Next-Cursor": _encode_cursor(rows[-1].created_at, rows[-1].id)}
+
+    return fast_response([
+        {
+            "txnId": row.txn_id,
+            "kind": row.kind,
+            "points": row.points,
+            "reversesTxnId": row.reverses_txn_id,
+            "createdAt": row.created_at.isoformat()
+        }
+        for row in rows
+    ], TRANSACTION_HISTORY, headers=headers)
+
+
+def _list_customer_transactions(db: Session, brand_id: str, customer_id: str, limit: int,
+                                after: Optional[Tuple[datetime, str]],
+                                since: Optional[datetime], until: Optional[datetime]) -> list:
     # Validate brand exists
     brand = BrandCRUD.get_by_id(db, brand_id)
     if not brand:
         raise HTTPException(status_code=404, detail=f"Brand '{brand_id}' not found")
 
-    # Get customer by brand customer ID
-    brand_customer = BrandCustomerCRUD.get_by_brand_customer_id(db, brand_id, body.customerId)
-    if not brand_customer:
-        raise HTTPException(status_code=404, detail=f"Customer '{body.customerId}' not found for this brand")
-
-    phone_number = brand_customer.phone_number
-
-    # Check if transaction already exists for this brand
-    if TransactionCRUD.get_by_id(db, brand_id, body.txnId):
-        raise HTTPException(status_code=409, detail=f"Transaction ID '{body.txnId}' already used for this brand")
-
-    # Get provision
-    provision = ProvisionCRUD.get_by_id(db, body.provisionId)
-    if not provision:
-        raise HTTPException(status_code=404, detail="Provision not found")
-
-    # Check if expired
-    now = datetime.now(timezone.utc)
-    # Ensure provision expires_at is timezone-aware for comparison
-    expires_at = provision.expires_at
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    if now > expires_at:
-        raise HTTPException(status_code=410, detail="Provision expired")
-
-    # Validate provision matches user and brand (using brandCustomerId)
-    if provision.user_id != body.customerId or provision.brand_id != brand_id:
-        raise HTTPException(status_code=400, detail="Provision details mismatch")
-
-    # Check if provision has enough remaining points for this redemption
-    if provision.remaining_points < body.points:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient provisioned points. Requested: {body.points}, Available: {provision.remaining_points}"
-        )
+    # Validate customer is registered with this brand
+    if BrandCustomerCRUD.get_phone_number(db, brand_id, customer_id) is None:
+        raise HTTPException(status_code=404, detail=f"Customer '{customer_id}' not found for this brand")
 
-    # Points are already locked in provision, don't deduct from balance again
-    # Just update the provision's remaining points
-    provision = ProvisionCRUD.update_remaining_points(db, provision, body.points)
+    return TransactionCRUD.list_for_customer(db, brand_id, customer_id, limit, after, since, until)
 
-    # Create transaction record (using brandCustomerId as user_id)
-    TransactionCRUD.create(db, body.txnId, brand_id, body.customerId, -body.points)
 
-    # Remove provision only if fully used
-    provision_status = "fully_redeemed" if provision.remaining_points == 0 else "partially_redeemed"
-    if provision.remaining_points == 0:
-        ProvisionCRUD.delete(db, provision)
+def _to_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Filters are compared against created_at, which is stored in UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # If naive datetime, assume UTC
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
 
-    # Get updated balance (using brandCustomerId as user_id)
-    balance = BalanceCRUD.get_or_create(db, brand_id, body.customerId)
 
-    return {
-        "status": "redeemed",
-        "txnId": body.txnId,
-        "brandId": brand_id,
-        "customerId": body.customerId,
-        "phoneNumber": phone_number,
-        "redeemedPoints": body.points,
-        "provisionStatus": provision_status,
-        "remainingProvisionPoints": provision.remaining_points if provision.remaining_points > 0 else 0,
-        "currentBalance": balance.points,
-        "updatedAt": balance.updated_at.isoformat()
-    }
+def _encode_cursor(created_at: datetime, txn_key: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{txn_key}".encode()).decode()
 
 
-@router.post("/brands/{brand_id}/void")
-def void_transaction(brand_id: str, body: VoidRequest, db: Session = Depends(get_db)):
-    """Void/reverse a transaction"""
-    # Get transaction for this brand
-    txn = TransactionCRUD.get_by_id(db, brand_id, body.txnId)
-    if not txn:
-        raise HTTPException(status_code=404, detail=f"Transaction '{body.txnId}' not found for this brand")
-
-    # Reverse the points
-    balance = BalanceCRUD.get_or_create(db, txn.brand_id, txn.user_id)
-    BalanceCRUD.update_points(db, balance, -txn.points)
-
-    # Delete transaction
-    TransactionCRUD.delete(db, txn)
-
-    return {
-        "voided": True,
-        "txnId": body.txnId,
-        "status": "reversed"
-    }
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, txn_key = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), txn_key
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
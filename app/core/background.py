@@ -0,0 +1,102 @@
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.crud import JobLeaseCRUD, LedgerCRUD, ProvisionCRUD, unit_of_work
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Per-job run counters and last result, reported by the / health check
+job_stats: Dict[str, dict] = {}
+
+# Identifies this worker in job leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# A job's lease outlives this many intervals, so a stopped worker's jobs move on after that
+LEASE_INTERVALS = 3
+
+
+def run_job(job: Callable[[Session], Any]) -> Any:
+    """Run `job(db)` in its own session and commit it"""
+    db = SessionLocal()
+    try:
+        result = job(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_periodically(name: str, interval_seconds: float, job: Callable[[Session], Any]) -> None:
+    """Run a sync DB job every `interval_seconds` until cancelled
+
+    Each run gets its own session and transaction and runs in the
+    threadpool, so it never blocks request handling. Failures are logged
+    and retried on the next tick. Every worker schedules the job, but only
+    the one holding its lease in the database runs it; the others skip
+    their ticks until the lease expires.
+    """
+    stats = job_stats.setdefault(
+        name, {"runs": 0, "failures": 0, "skipped": 0, "lastResult": None, "lastRunAt": None}
+    )
+    acquire_lease = functools.partial(
+        JobLeaseCRUD.acquire, name=name, owner=WORKER_ID, ttl_seconds=interval_seconds * LEASE_INTERVALS
+    )
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            if not await run_in_threadpool(run_job, acquire_lease):
+                stats["skipped"] += 1
+                continue
+            result = await run_in_threadpool(run_job, job)
+            stats["lastResult"] = result
+            if result:
+                logger.info("%s: %s", name, result)
+        except Exception:
+            stats["failures"] += 1
+            logger.exception("%s failed", name)
+        stats["runs"] += 1
+        stats["lastRunAt"] = time.time()
+
+
+def sweep_expired_provisions(db: Session) -> Optional[dict]:
+    """Reclaim expired provisions in bounded batches, one transaction per batch"""
+    reclaimed = {"provisions": 0, "points": 0}
+    for _ in range(settings.PROVISION_SWEEP_MAX_BATCHES):
+        with unit_of_work(db):
+            batch = ProvisionCRUD.reclaim_expired(db, settings.PROVISION_SWEEP_BATCH_SIZE)
+        reclaimed["provisions"] += batch["provisions"]
+        reclaimed["points"] += batch["points"]
+        if batch["provisions"] < settings.PROVISION_SWEEP_BATCH_SIZE:
+            break
+    return reclaimed if reclaimed["provisions"] else None
+
+
+def snapshot_balances(db: Session) -> Optional[int]:
+    """Advance balance snapshots over new ledger entries, one transaction per batch"""
+    written = 0
+    for _ in range(settings.BALANCE_SNAPSHOT_MAX_BATCHES):
+        try:
+            with unit_of_work(db):
+                batch = LedgerCRUD.take_snapshots(
+                    db, settings.BALANCE_SNAPSHOT_BATCH_SIZE, settings.BALANCE_SNAPSHOT_LAG_SECONDS
+                )
+        except StaleDataError:
+            continue  # A concurrent run (e.g. `manage.py snapshot-balances`) folded this batch; re-read the watermark
+        written += batch
+        if batch == 0:
+            break
+    return written or None
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import Brand
+
+
+@dataclass(frozen=True)
+class CachedBrand:
+    """Immutable copy of a brand row, safe to share between sessions and threads"""
+    id: str
+    name: str
+
+
+class BrandRegistry:
+    """In-process cache of the (small, rarely changing) brands table
+
+    The registry is loaded at startup and reloaded when invalidated or when
+    older than `ttl_seconds`, so brands created by other workers show up
+    without a restart. Lookups of IDs that are not cached fall back to the
+    database, so a brand is never reported missing just because this
+    worker has not reloaded yet.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._brands: Dict[str, CachedBrand] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, db: Session) -> None:
+        """(Re)load every brand from the database"""
+        rows = db.query(Brand.id, Brand.name).all()
+        brands = {row.id: CachedBrand(id=row.id, name=row.name) for row in rows}
+        with self._lock:
+            self._brands = brands
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """Force a reload on the next lookup"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _is_fresh(self) -> bool:
+        loaded_at = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+    def get(self, db: Session, brand_id: str) -> Optional[CachedBrand]:
+        """Get a brand by ID"""
+        if self._is_fresh():
+            brand = self._brands.get(brand_id)
+            if brand is not None:
+                self.hits += 1
+                return brand
+
+        self.misses += 1
+        if not self._is_fresh():
+            self.load(db)
+            return self._brands.get(brand_id)
+
+        # Fresh cache but unknown ID: the brand may have been created by
+        # another worker since the last load
+        row = db.query(Brand.id, Brand.name).filter(Brand.id == brand_id).first()
+        if row is None:
+            return None
+        brand = CachedBrand(id=row.id, name=row.name)
+        with self._lock:
+            self._brands[brand.id] = brand
+        return brand
+
+    def all(self, db: Session) -> List[CachedBrand]:
+        """Get all brands"""
+        if self._is_fresh():
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.load(db)
+        return list(self._brands.values())
+
+    def stats(self) -> dict:
+        """Hit/miss counters for monitoring"""
+        return {
+            "size": len(self._brands),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU mapping with short-lived negative entries
+
+    Storing `None` records a negative result that expires after
+    `negative_ttl_seconds`; positive entries only leave through eviction or
+    `invalidate`. A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, max_size: int, negative_ttl_seconds: float):
+        self.max_size = max_size
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (True, value) on a hit and (False, None) on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Cache a value; `None` is cached as an expiring negative result"""
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.negative_ttl_seconds if value is None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a single entry"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters for monitoring"""
+        return {
+            "size": len(self._entries),
+            "maxSize": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+brand_registry = BrandRegistry(ttl_seconds=settings.BRAND_CACHE_TTL_SECONDS)
+
+# (brand_id, brand_customer_id) -> phone_number; the mapping never changes after registration
+customer_identity_cache = LRUCache(
+    max_size=settings.CUSTOMER_CACHE_SIZE,
+    negative_ttl_seconds=settings.CUSTOMER_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+# (brand_id, idempotency key) -> StoredResponse; only committed responses are cached
+idempotency_cache = LRUCache(max_size=settings.IDEMPOTENCY_CACHE_SIZE, negative_ttl_seconds=0)
@@ -1,3 +1,5 @@
+from typing import Dict, List, Literal, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -9,8 +11,92 @@ class Settings(BaseSettings):
     APP_VERSION: str = "1.0.0"
     DEBUG: bool = True
 
+    # Startup: "development" creates tables and seeds sample brands in every worker (and
+    # `python main.py` reloads on changes); "production" expects `python manage.py init`
+    # to have run once and only checks the schema before preloading caches
+    STARTUP_MODE: Literal["development", "production"] = "development"
+
     # Database
     DATABASE_URL: str = "sqlite:///./loyalty.db"
+    DB_ASYNC: bool = False  # Serve POS routes from an AsyncEngine (needs aiosqlite / asyncpg)
+    ASYNC_DATABASE_URL: Optional[str] = None  # Defaults to DATABASE_URL with the async driver
+    # Read replica for read-only GET routes (None: every read goes to the primary)
+    READ_DATABASE_URL: Optional[str] = None
+    ASYNC_READ_DATABASE_URL: Optional[str] = None  # Defaults to READ_DATABASE_URL with the async driver
+    # Reads sending an X-Consistency-Token issued this recently go to the primary (replica lag bound)
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+
+    # Group commit: write requests share one transaction per short window (best for SQLite)
+    GROUP_COMMIT_ENABLED: bool = False
+    GROUP_COMMIT_WINDOW_MS: float = 2.0
+    GROUP_COMMIT_MAX_BATCH: int = 256
+
+    # Connection pool (sizing applies to file SQLite and server databases)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # Seconds before a server connection is replaced
+    DB_POOL_PRE_PING: bool = True  # Check server connections before use
+    SQLITE_POOL: Literal["queue", "null"] = "queue"  # In-memory SQLite always uses a single static connection
+
+    # SQLite performance profile (applied to every new connection; ignored for other databases)
+    SQLITE_TUNING_ENABLED: bool = True
+    SQLITE_JOURNAL_MODE: Literal["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"] = "WAL"
+    SQLITE_SYNCHRONOUS: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # Bytes of the file to memory-map
+    SQLITE_CACHE_SIZE: int = -64000  # Negative = KiB, positive = pages
+    SQLITE_TEMP_STORE: Literal["DEFAULT", "FILE", "MEMORY"] = "MEMORY"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # Wait this long for a lock instead of failing
+
+    # Caching
+    BRAND_CACHE_ENABLED: bool = True
+    BRAND_CACHE_TTL_SECONDS: int = 60  # Reload interval so other workers' new brands appear
+    CUSTOMER_CACHE_SIZE: int = 100_000  # Brand customer ID -> phone entries, 0 disables
+    CUSTOMER_CACHE_NEGATIVE_TTL_SECONDS: float = 5.0  # How long "not registered" is remembered
+
+    # Sharded balances for hot accounts ("brand_id:brand_customer_id" entries)
+    SHARDED_BALANCES: List[str] = []
+    BALANCE_SHARD_COUNT: int = 8
+    BALANCE_SHARD_FOLD_INTERVAL_SECONDS: float = 30.0
+
+    # Expired-provision sweeper (returns locked points to balances)
+    PROVISION_SWEEP_ENABLED: bool = True
+    PROVISION_SWEEP_INTERVAL_SECONDS: float = 60.0
+    PROVISION_SWEEP_BATCH_SIZE: int = 500
+    PROVISION_SWEEP_MAX_BATCHES: int = 20  # Per run, so one run stays bounded
+
+    # Ledger snapshots (balance = snapshot + ledger tail - active provisions)
+    BALANCE_SNAPSHOT_ENABLED: bool = True
+    BALANCE_SNAPSHOT_INTERVAL_SECONDS: float = 300.0
+    BALANCE_SNAPSHOT_BATCH_SIZE: int = 10000  # Ledger entries per transaction
+    BALANCE_SNAPSHOT_MAX_BATCHES: int = 10  # Per run
+    BALANCE_SNAPSHOT_LAG_SECONDS: float = 60.0  # Leave entries this young for the next run
+
+    # Idempotency-Key replay store
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_CACHE_SIZE: int = 50_000  # In-memory front cache entries, 0 disables
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = 300.0
+
+    # Webhooks (brand_id -> URL; "*" applies to every brand without its own entry)
+    WEBHOOK_URLS: Dict[str, str] = {}
+    WEBHOOK_DISPATCH_INTERVAL_SECONDS: float = 1.0
+    WEBHOOK_BATCH_SIZE: int = 100  # Events per delivery request
+    WEBHOOK_TIMEOUT_SECONDS: float = 5.0
+    WEBHOOK_MAX_BACKOFF_SECONDS: float = 300.0
+
+    # Observability (Prometheus text format at /metrics)
+    METRICS_ENABLED: bool = True
+    # Debug/test mode: X-DB-Queries/X-DB-Commits/X-DB-Time headers, N+1 warnings, query budgets
+    QUERY_DEBUG: bool = False
+    QUERY_N_PLUS_ONE_THRESHOLD: int = 5  # Same statement this many times in one request
+    # Sampling profiler (collapsed stacks per route at /admin/profiles)
+    PROFILER_ENABLED: bool = False
+    PROFILER_SAMPLE_RATE: float = 0.0  # Share of requests profiled; X-Profile: <token> profiles one request
+    PROFILER_INTERVAL_MS: float = 5.0
+    PROFILER_TOKEN: Optional[str] = None  # Required for X-Profile and /admin/profiles
+
+    # Serialization: hot routes render their JSON directly (orjson when installed)
+    RESPONSE_VALIDATION: bool = False  # Check those responses against their schemas (tests)
 
     # Security
     API_KEY: str = "test-secret"
@@ -0,0 +1,53 @@
+import time
+from typing import Optional
+
+from app.core.config import settings
+
+CONSISTENCY_HEADER = "X-Consistency-Token"
+
+
+def issue_token() -> str:
+    """A token recording when a write was committed (Unix time, ms precision)"""
+    return f"{time.time():.3f}"
+
+
+def requires_primary(token: Optional[str]) -> bool:
+    """Whether a read carrying `token` must go to the primary to see the client's own writes
+
+    True while the token is younger than READ_YOUR_WRITES_SECONDS, which
+    should exceed the replica's lag. Malformed tokens are ignored.
+    """
+    if not token:
+        return False
+    try:
+        written_at = float(token)
+    except ValueError:
+        return False
+    return abs(time.time() - written_at) < settings.READ_YOUR_WRITES_SECONDS
+
+
+class ConsistencyTokenMiddleware:
+    """ASGI middleware adding X-Consistency-Token to successful write responses
+
+    Clients echo the header on their next reads (e.g. the balance check
+    right after an earn) so those are served by the primary instead of a
+    replica that may lag behind. Only installed with READ_DATABASE_URL.
+    """
+
+    SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in self.SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                header = (CONSISTENCY_HEADER.lower().encode(), issue_token().encode())
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,18 +1,88 @@
+from sqlalchemy import delete, event, insert, or_, select, update, func, bindparam, tuple_, Select, Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from datetime import datetime, timezone
-from typing import Optional, List
-from app.models import Brand, Balance, Transaction, Provision, Customer, BrandCustomer
+from sqlalchemy.orm.exc import StaleDataError
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Iterator, Iterable, Dict, Set, Sequence, Any, Union, NamedTuple, Tuple, Callable
+import functools
+import json
+import random
+from app.models import (Brand, Balance, BalanceShard, BalanceSnapshot, Transaction, Provision, Customer, BrandCustomer, IdempotencyKey,
+                        OutboxEvent, WebhookCursor, JobLease)
+from app.core.config import settings
+from app.core.cache import brand_registry, customer_identity_cache, CachedBrand
+from app.core.metrics import instrument_crud
 
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
 
+
+def chunked(values: Sequence, size: int = IN_CHUNK_SIZE) -> Iterator[Sequence]:
+    """Split a sequence into slices of at most `size` items"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+@contextmanager
+def unit_of_work(db: Session) -> Iterator[Session]:
+    """Run a block of CRUD calls as one database transaction.
+
+    CRUD helpers only flush; the block commits once on success and rolls
+    back everything on any exception (including HTTPException).
+
+    Inside a group commit the block runs in a SAVEPOINT instead and the
+    group-commit writer commits the whole batch.
+    """
+    if db.info.get("group_commit"):
+        with db.begin_nested():
+            yield db
+        return
+
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def after_commit(db: Session, callback: Callable[[], None]) -> None:
+    """Run `callback` once the session's transaction commits (dropped if it rolls back)
+
+    For cache invalidation: invalidating before the commit lets a concurrent
+    request reload the old state into the cache before the change is visible.
+    """
+    db.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session) -> None:
+    for callback in session.info.pop("after_commit", ()):
+        callback()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_after_commit(session: Session, previous_transaction) -> None:
+    # A rolled-back SAVEPOINT keeps them (a spare invalidation is harmless)
+    if previous_transaction.parent is None:
+        session.info.pop("after_commit", None)
+
+
+@instrument_crud
 class BrandCRUD:
     @staticmethod
-    def get_all(db: Session) -> List[Brand]:
-        """Get all brands"""
+    def get_all(db: Session) -> List[Union[Brand, CachedBrand]]:
+        """Get all brands (from the brand registry when enabled)"""
+        if settings.BRAND_CACHE_ENABLED:
+            return brand_registry.all(db)
         return db.query(Brand).all()
 
     @staticmethod
-    def get_by_id(db: Session, brand_id: str) -> Optional[Brand]:
-        """Get brand by ID"""
+    def get_by_id(db: Session, brand_id: str) -> Optional[Union[Brand, CachedBrand]]:
+        """Get brand by ID (from the brand registry when enabled)"""
+        if settings.BRAND_CACHE_ENABLED:
+            return brand_registry.get(db, brand_id)
         return db.query(Brand).filter(Brand.id == brand_id).first()
 
     @staticmethod
@@ -20,12 +90,42 @@ class BrandCRUD:
         """Create a new brand"""
         brand = Brand(id=brand_id, name=name)
         db.add(brand)
-        db.commit()
-        db.refresh(brand)
+        db.flush()
+        after_commit(db, brand_registry.invalidate)
         return brand
 
 
+class BalancePoints(NamedTuple):
+    points: int
+    updated_at: datetime
+
+
+# Hot accounts whose writes are spread over BALANCE_SHARD_COUNT sub-counters
+SHARDED_BALANCES = frozenset(
+    tuple(key.split(":", 1)) for key in settings.SHARDED_BALANCES if ":" in key
+)
+
+
+def shard_points(brand_id, user_id):
+    """Scalar subquery: points in a balance's unfolded shard rows
+
+    Reads add it for every account, not only the configured ones, so an
+    account dropped from SHARDED_BALANCES keeps its points until the
+    fold job moves them into the balance row.
+    """
+    return select(func.coalesce(func.sum(BalanceShard.points), 0)).where(
+        BalanceShard.brand_id == brand_id,
+        BalanceShard.user_id == user_id
+    ).scalar_subquery()
+
+
+@instrument_crud
 class BalanceCRUD:
+    @staticmethod
+    def is_sharded(brand_id: str, user_id: str) -> bool:
+        """Whether writes to this balance go to shard rows"""
+        return (brand_id, user_id) in SHARDED_BALANCES
+
     @staticmethod
     def get_or_create(db: Session, brand_id: str, user_id: str) -> Balance:
         """Get or create balance for brand and user"""
@@ -37,21 +137,248 @@ class BalanceCRUD:
         if not balance:
             balance = Balance(brand_id=brand_id, user_id=user_id, points=0)
             db.add(balance)
-            db.commit()
-            db.refresh(balance)
+            db.flush()
 
         return balance
 
     @staticmethod
-    def update_points(db: Session, balance: Balance, points_delta: int) -> Balance:
-        """Update balance points"""
-        balance.points += points_delta
-        balance.updated_at = datetime.now(timezone.utc)
-        db.commit()
-        db.refresh(balance)
-        return balance
+    def bulk_credit(db: Session, brand_id: str, points: Dict[str, int]) -> None:
+        """Add points to many balances of a brand, creating missing rows
+
+        Existing rows are found with chunked IN queries and updated with one
+        executemany; missing rows are created with one executemany insert.
+        """
+        if not points:
+            return
+        existing = set()
+        for chunk in chunked(list(points)):
+            existing.update(db.execute(select(Balance.user_id).where(
+                Balance.brand_id == brand_id,
+                Balance.user_id.in_(chunk)
+            )).scalars())
+
+        now = datetime.now(timezone.utc)
+        credits = [
+            {"b_user_id": user_id, "b_points": delta}
+            for user_id, delta in points.items() if user_id in existing and delta
+        ]
+        if credits:
+            balances = Balance.__table__
+            db.execute(
+                balances.update()
+                .where(balances.c.brand_id == brand_id, balances.c.user_id == bindparam("b_user_id"))
+                .values(points=balances.c.points + bindparam("b_points"), updated_at=now),
+                credits
+            )
+        missing = [
+            {"brand_id": brand_id, "user_id": user_id, "points": delta, "updated_at": now}
+            for user_id, delta in points.items() if user_id not in existing
+        ]
+        if missing:
+            db.execute(insert(Balance), missing)
+
+    @staticmethod
+    def bulk_increment(db: Session, brand_id: str, points: Dict[str, int]) -> Dict[str, int]:
+        """Atomically add points to many balances; returns the new points per user
+
+        Plain balances get one bulk_credit and one chunked IN read-back,
+        which sees this transaction's own increments; sharded balances go
+        through increment() one by one.
+        """
+        totals = {}
+        plain = {}
+        for user_id, delta in points.items():
+            if BalanceCRUD.is_sharded(brand_id, user_id):
+                totals[user_id] = BalanceCRUD.increment(db, brand_id, user_id, delta).points
+            else:
+                plain[user_id] = delta
+        BalanceCRUD.bulk_credit(db, brand_id, plain)
+        for chunk in chunked(list(plain)):
+            totals.update(db.execute(select(Balance.user_id, Balance.points).where(
+                Balance.brand_id == brand_id,
+                Balance.user_id.in_(chunk)
+            )).all())
+        return totals
+
+    @staticmethod
+    def update_points(db: Session, brand_id: str, user_id: str, points_delta: int,
+                      min_points: Optional[int] = None) -> Optional[Row]:
+        """Atomically add `points_delta` to a balance in a single UPDATE
+
+        Returns the new (points, updated_at), or None when there is no
+        balance row or, with `min_points`, when the balance is below it.
+        The increment happens in the database, so concurrent writers from
+        other workers never lose updates.
+        """
+        query = update(Balance).where(
+            Balance.brand_id == brand_id,
+            Balance.user_id == user_id
+        )
+        if min_points is not None:
+            query = query.where(Balance.points >= min_points)
+        query = query.values(
+            points=Balance.points + points_delta,
+            updated_at=datetime.now(timezone.utc)
+        ).execution_options(synchronize_session=False)
+
+        if db.get_bind().dialect.update_returning:
+            return db.execute(query.returning(Balance.points, Balance.updated_at)).first()
+
+        # Databases without UPDATE ... RETURNING: read back inside the same transaction
+        if db.execute(query).rowcount == 0:
+            return None
+        return db.execute(select(Balance.points, Balance.updated_at).where(
+            Balance.brand_id == brand_id,
+            Balance.user_id == user_id
+        )).first()
+
+    @staticmethod
+    def deduct_points(db: Session, brand_id: str, user_id: str, points: int) -> Optional[Row]:
+        """Atomically deduct points only if the balance covers them
 
+        Returns the new (points, updated_at), or None if the balance is
+        missing or insufficient. The account's shards are folded first so
+        the guard sees the full amount, including shards left behind by an
+        account that is no longer in SHARDED_BALANCES.
+        """
+        BalanceCRUD.fold_shards(db, brand_id, user_id)
+        return BalanceCRUD.update_points(db, brand_id, user_id, -points, min_points=points)
 
+    @staticmethod
+    def increment(db: Session, brand_id: str, user_id: str, points_delta: int) -> BalancePoints:
+        """Atomically add points, creating the balance row if it does not exist yet
+
+        For sharded balances the delta goes to a random shard row, so
+        concurrent writers rarely contend on the same row.
+        """
+        if BalanceCRUD.is_sharded(brand_id, user_id):
+            BalanceCRUD._increment_shard(db, brand_id, user_id, points_delta)
+            return BalanceCRUD.get_points(db, brand_id, user_id)
+        return BalanceCRUD._increment_row(db, brand_id, user_id, points_delta)
+
+    @staticmethod
+    def _increment_row(db: Session, brand_id: str, user_id: str, points_delta: int) -> BalancePoints:
+        row = BalanceCRUD.update_points(db, brand_id, user_id, points_delta)
+        if row is None:
+            try:
+                with db.begin_nested():
+                    db.add(Balance(brand_id=brand_id, user_id=user_id, points=0))
+            except IntegrityError:
+                pass  # Created concurrently by another request
+            row = BalanceCRUD.update_points(db, brand_id, user_id, points_delta)
+        return BalancePoints(row.points, row.updated_at)
+
+    @staticmethod
+    def _increment_shard(db: Session, brand_id: str, user_id: str, points_delta: int) -> None:
+        shard = random.randrange(settings.BALANCE_SHARD_COUNT)
+        query = update(BalanceShard).where(
+            BalanceShard.brand_id == brand_id,
+            BalanceShard.user_id == user_id,
+            BalanceShard.shard == shard
+        ).values(
+            points=BalanceShard.points + points_delta,
+            updated_at=datetime.now(timezone.utc)
+        ).execution_options(synchronize_session=False)
+        if db.execute(query).rowcount:
+            return
+
+        try:
+            with db.begin_nested():
+                db.add(BalanceShard(brand_id=brand_id, user_id=user_id, shard=shard, points=points_delta))
+        except IntegrityError:
+            db.execute(query)  # Shard row created concurrently
+            return
+
+        # New shard rows are rare (first write after a fold); the balance row they fold into is also
+        # what listings and exports iterate, so create it now rather than on the next fold
+        try:
+            with db.begin_nested():
+                BalanceCRUD.get_or_create(db, brand_id, user_id)
+        except IntegrityError:
+            pass  # Created concurrently by another request
+
+    @staticmethod
+    def get_points(db: Session, brand_id: str, user_id: str) -> BalancePoints:
+        """Current points of a balance, including shards not folded yet; read-only
+
+        One statement when the balance row exists; a balance without one
+        has 0 points plus its shards.
+        """
+        latest_shard = select(func.max(BalanceShard.updated_at)).where(
+            BalanceShard.brand_id == brand_id,
+            BalanceShard.user_id == user_id
+        ).scalar_subquery()
+        query = select(
+            Balance.points + shard_points(brand_id, user_id), Balance.updated_at, latest_shard
+        ).where(
+            Balance.brand_id == brand_id,
+            Balance.user_id == user_id
+        )
+        row = db.execute(query).first()
+        if row is None:
+            # No balance row yet (never credited, or only shard rows so far). Reads run on the
+            # replica too, so this must not create one; "now" is naive like stored timestamps.
+            points, shards_updated_at = db.execute(select(shard_points(brand_id, user_id), latest_shard)).one()
+            return BalancePoints(points, shards_updated_at or datetime.now(timezone.utc).replace(tzinfo=None))
+        points, updated_at, shards_updated_at = row
+        if shards_updated_at is not None and shards_updated_at > updated_at:
+            updated_at = shards_updated_at
+        return BalancePoints(points, updated_at)
+
+    @staticmethod
+    def stream_for_brand(db: Session, brand_id: str, after_user_id: Optional[str] = None,
+                         batch_size: int = 1000) -> Iterator[Row]:
+        """Iterate over a brand's balances (shards included) in user ID order, fetching in batches"""
+        points = Balance.points + shard_points(Balance.brand_id, Balance.user_id)
+        query = select(Balance.user_id, points.label("points"), Balance.updated_at).where(
+            Balance.brand_id == brand_id
+        ).order_by(Balance.user_id)
+        if after_user_id is not None:
+            query = query.where(Balance.user_id > after_user_id)
+        yield from db.execute(query.execution_options(yield_per=batch_size))
+
+    @staticmethod
+    def fold_shards(db: Session, brand_id: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        """Move shard totals into balances.points; returns the number of balances folded
+
+        Shard rows are deleted and their points added to the main row in
+        the same transaction, so the visible total never changes. The rows
+        are claimed with DELETE ... RETURNING, so an increment racing the
+        fold either lands before it (and is folded) or recreates its shard
+        row afterwards, and a concurrent fold finds nothing left to credit.
+        """
+        conditions = []
+        if brand_id is not None:
+            conditions = [BalanceShard.brand_id == brand_id, BalanceShard.user_id == user_id]
+        if db.get_bind().dialect.delete_returning:
+            shards = db.execute(
+                delete(BalanceShard).where(*conditions)
+                .returning(BalanceShard.brand_id, BalanceShard.user_id, BalanceShard.points)
+                .execution_options(synchronize_session=False)
+            ).all()
+        else:
+            # Databases without DELETE ... RETURNING: lock the rows, then delete exactly those
+            shards = db.execute(
+                select(BalanceShard.id, BalanceShard.brand_id, BalanceShard.user_id, BalanceShard.points)
+                .where(*conditions).with_for_update()
+            ).all()
+            for chunk in chunked([shard.id for shard in shards]):
+                db.execute(
+                    BalanceShard.__table__.delete().where(BalanceShard.id.in_(chunk))
+                )
+        if not shards:
+            return 0
+
+        totals: Dict[Tuple[str, str], int] = {}
+        for shard in shards:
+            key = (shard.brand_id, shard.user_id)
+            totals[key] = totals.get(key, 0) + shard.points
+        for (shard_brand_id, shard_user_id), points in totals.items():
+            BalanceCRUD._increment_row(db, shard_brand_id, shard_user_id, points)
+        return len(totals)
+
+
+@instrument_crud
 class TransactionCRUD:
     @staticmethod
     def get_by_id(db: Session, brand_id: str, txn_id: str) -> Optional[Transaction]:
@@ -62,8 +389,9 @@ class TransactionCRUD:
         ).first()
 
     @staticmethod
-    def create(db: Session, txn_id: str, brand_id: str, user_id: str, points: int) -> Transaction:
-        """Create a new transaction"""
+    def create(db: Session, txn_id: str, brand_id: str, user_id: str, points: int,
+               kind: str = "earn", reverses_txn_id: Optional[str] = None) -> Transaction:
+        """Append a ledger entry"""
         # Create composite ID
         composite_id = f"{brand_id}:{txn_id}"
         txn = Transaction(
@@ -71,20 +399,140 @@ class TransactionCRUD:
             txn_id=txn_id,
             brand_id=brand_id,
             user_id=user_id,
-            points=points
+            points=points,
+            kind=kind,
+            reverses_txn_id=reverses_txn_id
         )
         db.add(txn)
-        db.commit()
-        db.refresh(txn)
+        db.flush()
         return txn
 
     @staticmethod
-    def delete(db: Session, txn: Transaction) -> None:
-        """Delete a transaction"""
-        db.delete(txn)
-        db.commit()
+    def list_for_customer(db: Session, brand_id: str, user_id: str, limit: int,
+                          after: Optional[Tuple[datetime, str]] = None,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Row]:
+        """One page of a customer's ledger entries, newest first
+
+        Keyset-paginated on the (brand_id, user_id, created_at, id) index:
+        `after` is the (created_at, id) of the last entry of the previous
+        page, so every page is a single index range scan. `since` is
+        inclusive and `until` exclusive.
+        """
+        query = select(
+            Transaction.id,
+            Transaction.txn_id,
+            Transaction.kind,
+            Transaction.points,
+            Transaction.reverses_txn_id,
+            Transaction.created_at,
+        ).where(
+            Transaction.brand_id == brand_id,
+            Transaction.user_id == user_id
+        )
+        if since is not None:
+            query = query.where(Transaction.created_at >= since)
+        if until is not None:
+            query = query.where(Transaction.created_at < until)
+        if after is not None:
+            query = query.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(*after))
+        query = query.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit)
+        return db.execute(query).all()
+
+    @staticmethod
+    def stream_for_brand(db: Session, brand_id: str, after_seq: int = 0,
+                         since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         batch_size: int = 1000) -> Iterator[Row]:
+        """Iterate over a brand's ledger in sequence order, fetching Core rows in batches
+
+        Resume an interrupted iteration by passing the last `seq` seen as
+        `after_seq`.
+        """
+        query = select(
+            Transaction.seq,
+            Transaction.txn_id,
+            Transaction.user_id,
+            Transaction.kind,
+            Transaction.points,
+            Transaction.reverses_txn_id,
+            Transaction.created_at,
+        ).where(
+            Transaction.brand_id == brand_id,
+            Transaction.seq > after_seq
+        )
+        if since is not None:
+            query = query.where(Transaction.created_at >= since)
+        if until is not None:
+            query = query.where(Transaction.created_at < until)
+        query = query.order_by(Transaction.seq)
+        yield from db.execute(query.execution_options(yield_per=batch_size))
 
+    @staticmethod
+    def void_txn_id(txn_id: str) -> str:
+        """Transaction ID of the compensating entry that voids `txn_id` (a reserved prefix)"""
+        return f"void:{txn_id}"
+
+    @staticmethod
+    def import_txn_id(brand_customer_id: str) -> str:
+        """Transaction ID of an imported customer's initial points (a reserved prefix)"""
+        return f"import:{brand_customer_id}"
 
+    @staticmethod
+    def get_void(db: Session, brand_id: str, txn_id: str) -> Optional[Transaction]:
+        """The void reversing `txn_id`, if any"""
+        return db.query(Transaction).filter(
+            Transaction.brand_id == brand_id,
+            Transaction.reverses_txn_id == txn_id,
+            Transaction.kind == "void"
+        ).first()
+
+    @staticmethod
+    def create_void(db: Session, txn: Transaction) -> Transaction:
+        """Append the compensating entry reversing `txn`
+
+        The unique (brand_id, reverses_txn_id) index rejects a second void
+        of the same entry.
+        """
+        return TransactionCRUD.create(
+            db, TransactionCRUD.void_txn_id(txn.txn_id), txn.brand_id, txn.user_id, -txn.points,
+            kind="void", reverses_txn_id=txn.txn_id
+        )
+
+    @staticmethod
+    def get_existing_txn_ids(db: Session, brand_id: str, txn_ids: Iterable[str]) -> Set[str]:
+        """Return which of the given transaction IDs are already used by the brand"""
+        txn_ids = list(dict.fromkeys(txn_ids))
+        existing = set()
+        for chunk in chunked(txn_ids):
+            existing.update(row.txn_id for row in db.query(Transaction.txn_id).filter(
+                Transaction.brand_id == brand_id,
+                Transaction.txn_id.in_(chunk)
+            ))
+        return existing
+
+    @staticmethod
+    def bulk_create(db: Session, brand_id: str, rows: List[dict], kind: str = "earn") -> None:
+        """Insert many transactions with a single executemany
+
+        Each row needs txn_id, user_id and points.
+        """
+        if not rows:
+            return
+        now = datetime.now(timezone.utc)
+        db.execute(insert(Transaction), [
+            {
+                "id": f"{brand_id}:{row['txn_id']}",
+                "txn_id": row["txn_id"],
+                "brand_id": brand_id,
+                "user_id": row["user_id"],
+                "points": row["points"],
+                "kind": kind,
+                "created_at": now,
+            }
+            for row in rows
+        ])
+
+
+@instrument_crud
 class ProvisionCRUD:
     @staticmethod
     def get_by_id(db: Session, provision_id: str) -> Optional[Provision]:
@@ -104,25 +552,229 @@ class ProvisionCRUD:
             expires_at=expires_at
         )
         db.add(provision)
-        db.commit()
-        db.refresh(provision)
+        db.flush()
         return provision
 
     @staticmethod
     def update_remaining_points(db: Session, provision: Provision, points_used: int) -> Provision:
-        """Update remaining points after partial redemption"""
+        """Update remaining points after a redemption; a fully used provision becomes redeemed"""
         provision.remaining_points -= points_used
-        db.commit()
-        db.refresh(provision)
+        if provision.remaining_points == 0:
+            provision.status = "redeemed"
+        db.flush()
         return provision
 
     @staticmethod
-    def delete(db: Session, provision: Provision) -> None:
-        """Delete a provision"""
-        db.delete(provision)
-        db.commit()
+    def reclaim_expired(db: Session, batch_size: int) -> Dict[str, int]:
+        """Return the remaining points of up to `batch_size` expired provisions and mark them expired
+
+        Uses the (status, expires_at) index. The provisions are marked and
+        read with one UPDATE ... RETURNING, so only rows this call moved out
+        of "active" are refunded; balances are credited with one executemany
+        UPDATE. The provision rows are kept for auditing.
+        """
+        now = datetime.now(timezone.utc)
+        due = (
+            select(Provision.provision_id)
+            .where(Provision.status == "active", Provision.expires_at < now)
+            .order_by(Provision.expires_at)
+            .limit(batch_size)
+        )
+        if db.get_bind().dialect.update_returning:
+            # Claim the batch in one statement; the status guard makes a concurrent
+            # sweeper (or a re-run) skip rows that are already expired
+            expired = db.execute(
+                update(Provision)
+                .where(Provision.provision_id.in_(due.scalar_subquery()), Provision.status == "active")
+                .values(status="expired")
+                .returning(Provision.brand_id, Provision.user_id, Provision.remaining_points)
+                .execution_options(synchronize_session=False)
+            ).all()
+        else:
+            # Databases without UPDATE ... RETURNING: lock the batch, then mark exactly those rows
+            expired = db.execute(
+                due.add_columns(Provision.brand_id, Provision.user_id, Provision.remaining_points).with_for_update()
+            ).all()
+            for chunk in chunked([provision.provision_id for provision in expired]):
+                db.execute(
+                    update(Provision).where(Provision.provision_id.in_(chunk)).values(status="expired")
+                    .execution_options(synchronize_session=False)
+                )
+        if not expired:
+            return {"provisions": 0, "points": 0}
+
+        credits: Dict[Tuple[str, str], int] = {}
+        for provision in expired:
+            key = (provision.brand_id, provision.user_id)
+            credits[key] = credits.get(key, 0) + provision.remaining_points
+
+        params = [
+            {"b_brand_id": brand_id, "b_user_id": user_id, "b_points": points}
+            for (brand_id, user_id), points in credits.items() if points
+        ]
+        if params:
+            balances = Balance.__table__
+            db.execute(
+                balances.update()
+                .where(balances.c.brand_id == bindparam("b_brand_id"), balances.c.user_id == bindparam("b_user_id"))
+                .values(points=balances.c.points + bindparam("b_points"), updated_at=now),
+                params
+            )
+        return {"provisions": len(expired), "points": sum(credits.values())}
+
+
+@instrument_crud
+class LedgerCRUD:
+    @staticmethod
+    def take_snapshots(db: Session, batch_size: int, lag_seconds: float) -> int:
+        """Fold up to `batch_size` ledger sequence numbers into balance snapshots
+
+        Every snapshot is at or behind the highest `ledger_seq` recorded,
+        and no entry between a snapshot's `ledger_seq` and that watermark
+        belongs to its balance. Entries younger than `lag_seconds` are left
+        for the next run, so sequence numbers still in uncommitted
+        transactions on other connections are not skipped. Returns the
+        number of snapshots written.
+
+        The watermark is compare-and-set: snapshot updates only match rows
+        still at or behind it, and inserts hit the (brand_id, user_id)
+        unique index, so if a concurrent run already folded this range the
+        call raises StaleDataError and the transaction must roll back
+        instead of applying the same deltas twice.
+        """
+        watermark = db.scalar(select(func.max(BalanceSnapshot.ledger_seq))) or 0
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=lag_seconds)
+        batch = (
+            select(Transaction.seq)
+            .where(Transaction.seq > watermark, Transaction.created_at <= cutoff)
+            .order_by(Transaction.seq)
+            .limit(batch_size)
+            .subquery()
+        )
+        upto = db.scalar(select(func.max(batch.c.seq)))
+        if upto is None:
+            return 0
+
+        snapshots = BalanceSnapshot.__table__
+        deltas = db.execute(
+            select(Transaction.brand_id, Transaction.user_id, func.sum(Transaction.points).label("points"),
+                   snapshots.c.id.label("snapshot_id"))
+            .outerjoin(snapshots, (snapshots.c.brand_id == Transaction.brand_id)
+                       & (snapshots.c.user_id == Transaction.user_id))
+            .where(Transaction.seq > watermark, Transaction.seq <= upto)
+            .group_by(Transaction.brand_id, Transaction.user_id, snapshots.c.id)
+        ).all()
+
+        now = datetime.now(timezone.utc)
+        updates = [{"s_id": row.snapshot_id, "s_points": row.points} for row in deltas if row.snapshot_id]
+        inserts = [
+            {"brand_id": row.brand_id, "user_id": row.user_id, "ledger_seq": upto,
+             "points": row.points, "updated_at": now}
+            for row in deltas if not row.snapshot_id
+        ]
+        if updates:
+            result = db.execute(
+                snapshots.update()
+                .where(snapshots.c.id == bindparam("s_id"), snapshots.c.ledger_seq <= watermark)
+                .values(points=snapshots.c.points + bindparam("s_points"), ledger_seq=upto, updated_at=now),
+                updates
+            )
+            if db.get_bind().dialect.supports_sane_multi_rowcount and result.rowcount != len(updates):
+                raise StaleDataError("Balance snapshots were advanced by a concurrent run")
+        if inserts:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(BalanceSnapshot), inserts)
+            except IntegrityError:
+                raise StaleDataError("Balance snapshots were advanced by a concurrent run")
+        return len(deltas)
+
+    @staticmethod
+    def rebuild_balances(db: Session, brand_id: str, dry_run: bool = False) -> Dict[str, int]:
+        """Recompute every balance of a brand from its snapshots and ledger tails
+
+        A balance is its snapshot points plus the ledger entries after the
+        snapshot, minus the points locked in active provisions. Wrong
+        balance rows are overwritten, missing ones created and shard rows
+        folded away. Concurrent writes to the brand are not safe while
+        this runs.
+        """
+        snapshots = BalanceSnapshot.__table__
+        totals: Dict[str, int] = {}
+        oldest_snapshot = None
+        for row in db.execute(
+            select(BalanceSnapshot.user_id, BalanceSnapshot.points, BalanceSnapshot.ledger_seq)
+            .where(BalanceSnapshot.brand_id == brand_id)
+        ):
+            totals[row.user_id] = row.points
+            if oldest_snapshot is None or row.ledger_seq < oldest_snapshot:
+                oldest_snapshot = row.ledger_seq
+
+        # Balances without a snapshot have no entries at or below any snapshot's
+        # ledger_seq, so only the ledger after the oldest snapshot is read
+        for row in db.execute(
+            select(Transaction.user_id, func.sum(Transaction.points).label("points"))
+            .outerjoin(snapshots, (snapshots.c.brand_id == Transaction.brand_id)
+                       & (snapshots.c.user_id == Transaction.user_id))
+            .where(Transaction.brand_id == brand_id,
+                   Transaction.seq > (oldest_snapshot or 0),
+                   Transaction.seq > func.coalesce(snapshots.c.ledger_seq, 0))
+            .group_by(Transaction.user_id)
+        ):
+            totals[row.user_id] = totals.get(row.user_id, 0) + row.points
+        for row in db.execute(
+            select(Provision.user_id, func.sum(Provision.remaining_points).label("points"))
+            .where(Provision.brand_id == brand_id, Provision.status == "active")
+            .group_by(Provision.user_id)
+        ):
+            totals[row.user_id] = totals.get(row.user_id, 0) - row.points
+
+        current = {
+            row.user_id: row.points
+            for row in db.execute(select(Balance.user_id, Balance.points).where(Balance.brand_id == brand_id))
+        }
+        shard_totals = {
+            row.user_id: row.points
+            for row in db.execute(
+                select(BalanceShard.user_id, func.sum(BalanceShard.points).label("points"))
+                .where(BalanceShard.brand_id == brand_id)
+                .group_by(BalanceShard.user_id)
+            )
+        }
+        for user_id in current:
+            totals.setdefault(user_id, 0)
+
+        corrected = [
+            user_id for user_id, points in totals.items()
+            if (current.get(user_id) or 0) + shard_totals.get(user_id, 0) != points
+        ]
+        if not dry_run:
+            now = datetime.now(timezone.utc)
+            stale = [
+                {"b_user_id": user_id, "b_points": points}
+                for user_id, points in totals.items()
+                if user_id in current and (current[user_id] != points or user_id in shard_totals)
+            ]
+            if stale:
+                balances = Balance.__table__
+                db.execute(
+                    balances.update()
+                    .where(balances.c.brand_id == brand_id, balances.c.user_id == bindparam("b_user_id"))
+                    .values(points=bindparam("b_points"), updated_at=now),
+                    stale
+                )
+            missing = [
+                {"brand_id": brand_id, "user_id": user_id, "points": points, "updated_at": now}
+                for user_id, points in totals.items() if user_id not in current
+            ]
+            if missing:
+                db.execute(insert(Balance), missing)
+            if shard_totals:
+                db.execute(BalanceShard.__table__.delete().where(BalanceShard.brand_id == brand_id))
+        return {"balances": len(totals), "corrected": len(corrected)}
 
 
+@instrument_crud
 class CustomerCRUD:
     @staticmethod
     def get_or_create(db: Session, phone_number: str) -> Customer:
@@ -132,8 +784,7 @@ class CustomerCRUD:
         if not customer:
             customer = Customer(phone_number=phone_number)
             db.add(customer)
-            db.commit()
-            db.refresh(customer)
+            db.flush()
 
         return customer
 
@@ -142,7 +793,25 @@ class CustomerCRUD:
         """Get customer by phone number"""
         return db.query(Customer).filter(Customer.phone_number == phone_number).first()
 
+    @staticmethod
+    def bulk_get_or_create(db: Session, phone_numbers: Sequence[str]) -> int:
+        """Create the customers that do not exist yet; returns how many were created"""
+        existing = set()
+        for chunk in chunked(phone_numbers):
+            existing.update(db.execute(
+                select(Customer.phone_number).where(Customer.phone_number.in_(chunk))
+            ).scalars())
+        now = datetime.now(timezone.utc)
+        new_customers = [
+            {"phone_number": phone_number, "created_at": now}
+            for phone_number in dict.fromkeys(phone_numbers) if phone_number not in existing
+        ]
+        if new_customers:
+            db.execute(insert(Customer), new_customers)
+        return len(new_customers)
+
 
+@instrument_crud
 class BrandCustomerCRUD:
     @staticmethod
     def create(db: Session, brand_id: str, phone_number: str, brand_customer_id: str) -> BrandCustomer:
@@ -159,8 +828,11 @@ class BrandCustomerCRUD:
             brand_customer_id=brand_customer_id
         )
         db.add(brand_customer)
-        db.commit()
-        db.refresh(brand_customer)
+        db.flush()
+
+        # Forget any cached "not registered" result for this ID once the
+        # registration is committed (and visible to the lookup that refills it)
+        after_commit(db, functools.partial(customer_identity_cache.invalidate, (brand_id, brand_customer_id)))
         return brand_customer
 
     @staticmethod
@@ -171,6 +843,80 @@ class BrandCustomerCRUD:
             BrandCustomer.brand_customer_id == brand_customer_id
         ).first()
 
+    @staticmethod
+    def get_phone_number(db: Session, brand_id: str, brand_customer_id: str) -> Optional[str]:
+        """Get the phone number registered under a brand customer ID (LRU cached)"""
+        key = (brand_id, brand_customer_id)
+        hit, phone_number = customer_identity_cache.get(key)
+        if hit:
+            return phone_number
+
+        row = db.query(BrandCustomer.phone_number).filter(
+            BrandCustomer.brand_id == brand_id,
+            BrandCustomer.brand_customer_id == brand_customer_id
+        ).first()
+        phone_number = row.phone_number if row else None
+        # A lagging replica may not have a new registration yet, so only the
+        # primary's "not registered" is cached
+        if phone_number is not None or not db.info.get("replica"):
+            customer_identity_cache.put(key, phone_number)
+        return phone_number
+
+    @staticmethod
+    def get_many_by_brand_customer_ids(db: Session, brand_id: str,
+                                       brand_customer_ids: Iterable[str]) -> Dict[str, str]:
+        """Map brand customer IDs that exist for the brand to their phone numbers"""
+        brand_customer_ids = list(dict.fromkeys(brand_customer_ids))
+        phones = {}
+        for chunk in chunked(brand_customer_ids):
+            for row in db.query(BrandCustomer.brand_customer_id, BrandCustomer.phone_number).filter(
+                BrandCustomer.brand_id == brand_id,
+                BrandCustomer.brand_customer_id.in_(chunk)
+            ):
+                phones[row.brand_customer_id] = row.phone_number
+        return phones
+
+    @staticmethod
+    def get_registered_phones(db: Session, brand_id: str, phone_numbers: Iterable[str]) -> Set[str]:
+        """Return which of the given phone numbers are already registered with the brand"""
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        registered = set()
+        for chunk in chunked(phone_numbers):
+            registered.update(db.execute(select(BrandCustomer.phone_number).where(
+                BrandCustomer.brand_id == brand_id,
+                BrandCustomer.phone_number.in_(chunk)
+            )).scalars())
+        return registered
+
+    @staticmethod
+    def bulk_create(db: Session, brand_id: str, rows: List[dict]) -> None:
+        """Register many customers to a brand with a single executemany
+
+        Each row needs phone_number and brand_customer_id; the customers
+        must already exist.
+        """
+        if not rows:
+            return
+        now = datetime.now(timezone.utc)
+        db.execute(insert(BrandCustomer), [
+            {
+                "id": f"{brand_id}:{row['phone_number']}",
+                "brand_id": brand_id,
+                "phone_number": row["phone_number"],
+                "brand_customer_id": row["brand_customer_id"],
+                "created_at": now,
+            }
+            for row in rows
+        ])
+        # Forget cached "not registered" results after the commit, as in create()
+        brand_customer_ids = [row["brand_customer_id"] for row in rows]
+
+        def forget() -> None:
+            for brand_customer_id in brand_customer_ids:
+                customer_identity_cache.invalidate((brand_id, brand_customer_id))
+
+        after_commit(db, forget)
+
     @staticmethod
     def get_by_phone(db: Session, brand_id: str, phone_number: str) -> Optional[BrandCustomer]:
         """Get brand-customer by phone number"""
@@ -183,3 +929,194 @@ class BrandCustomerCRUD:
     def list_by_brand(db: Session, brand_id: str) -> List[BrandCustomer]:
         """List all customers of a brand"""
         return db.query(BrandCustomer).filter(BrandCustomer.brand_id == brand_id).all()
+
+    @staticmethod
+    def _with_points_query(brand_id: str, after: Optional[str] = None) -> Select:
+        """Brand customers joined to their balance, in brand customer ID order"""
+        points = func.coalesce(Balance.points, 0) + shard_points(
+            BrandCustomer.brand_id, BrandCustomer.brand_customer_id
+        )
+
+        query = select(
+            BrandCustomer.phone_number,
+            BrandCustomer.brand_customer_id,
+            points.label("points"),
+            BrandCustomer.created_at,
+        ).outerjoin(
+            Balance,
+            (Balance.brand_id == BrandCustomer.brand_id)
+            & (Balance.user_id == BrandCustomer.brand_customer_id)
+        ).where(
+            BrandCustomer.brand_id == brand_id
+        ).order_by(BrandCustomer.brand_customer_id)
+
+        # Keyset pagination: continue after the last brand customer ID seen
+        if after is not None:
+            query = query.where(BrandCustomer.brand_customer_id > after)
+        return query
+
+    @staticmethod
+    def page_with_points(db: Session, brand_id: str, after: Optional[str], limit: int) -> List[Any]:
+        """List one page of a brand's customers with their points in a single query"""
+        query = BrandCustomerCRUD._with_points_query(brand_id, after).limit(limit)
+        return db.execute(query).all()
+
+    @staticmethod
+    def stream_with_points(db: Session, brand_id: str, after: Optional[str] = None,
+                           batch_size: int = 1000) -> Iterator[Any]:
+        """Iterate over all of a brand's customers with points, fetching in batches"""
+        query = BrandCustomerCRUD._with_points_query(brand_id, after)
+        yield from db.execute(query.execution_options(yield_per=batch_size))
+
+
+@instrument_crud
+class IdempotencyCRUD:
+    @staticmethod
+    def get(db: Session, brand_id: str, key: str) -> Optional[IdempotencyKey]:
+        """Get an unexpired stored response by brand and Idempotency-Key"""
+        return db.query(IdempotencyKey).filter(
+            IdempotencyKey.id == f"{brand_id}:{key}",
+            IdempotencyKey.expires_at > datetime.now(timezone.utc)
+        ).first()
+
+    @staticmethod
+    def create(db: Session, brand_id: str, key: str, fingerprint: str,
+               status_code: int, response: str) -> IdempotencyKey:
+        """Store a response; call inside the request's unit of work so it commits with the write"""
+        now = datetime.now(timezone.utc)
+        record = IdempotencyKey(
+            id=f"{brand_id}:{key}",
+            brand_id=brand_id,
+            key=key,
+            fingerprint=fingerprint,
+            status_code=status_code,
+            response=response,
+            created_at=now,
+            expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+        )
+        db.add(record)
+        db.flush()
+        return record
+
+    @staticmethod
+    def delete_expired(db: Session, batch_size: int = 1000) -> int:
+        """Delete up to `batch_size` expired keys; returns how many were removed"""
+        expired_ids = db.execute(
+            select(IdempotencyKey.id)
+            .where(IdempotencyKey.expires_at <= datetime.now(timezone.utc))
+            .limit(batch_size)
+        ).scalars().all()
+        for chunk in chunked(expired_ids):
+            db.execute(IdempotencyKey.__table__.delete().where(IdempotencyKey.id.in_(chunk)))
+        return len(expired_ids)
+
+
+@instrument_crud
+class OutboxCRUD:
+    @staticmethod
+    def webhook_url(brand_id: str) -> Optional[str]:
+        """Webhook URL configured for a brand, if any"""
+        return settings.WEBHOOK_URLS.get(brand_id) or settings.WEBHOOK_URLS.get("*")
+
+    @staticmethod
+    def add(db: Session, brand_id: str, event_type: str, data: dict) -> None:
+        """Queue a webhook event; call inside the write's unit of work so it commits with it"""
+        OutboxCRUD.add_many(db, brand_id, event_type, [data])
+
+    @staticmethod
+    def add_many(db: Session, brand_id: str, event_type: str, items: List[dict]) -> None:
+        """Queue one event per item in a single executemany insert"""
+        if not items or OutboxCRUD.webhook_url(brand_id) is None:
+            return
+        now = datetime.now(timezone.utc)
+        db.execute(insert(OutboxEvent), [
+            {"brand_id": brand_id, "event_type": event_type, "payload": json.dumps(data), "created_at": now}
+            for data in items
+        ])
+
+    @staticmethod
+    def pending_brand_ids(db: Session) -> List[str]:
+        """Brands with undelivered events"""
+        return db.execute(select(OutboxEvent.brand_id).distinct()).scalars().all()
+
+    @staticmethod
+    def get_cursors(db: Session, brand_ids: Iterable[str]) -> Dict[str, WebhookCursor]:
+        """Delivery cursors by brand, created for brands that have none yet"""
+        brand_ids = list(brand_ids)
+        cursors = {}
+        for chunk in chunked(brand_ids):
+            for cursor in db.query(WebhookCursor).filter(WebhookCursor.brand_id.in_(chunk)):
+                cursors[cursor.brand_id] = cursor
+        for brand_id in brand_ids:
+            if brand_id not in cursors:
+                cursors[brand_id] = WebhookCursor(brand_id=brand_id, last_event_id=0, attempts=0)
+                db.add(cursors[brand_id])
+        db.flush()
+        return cursors
+
+    @staticmethod
+    def get_batch(db: Session, brand_id: str, limit: int) -> List[Row]:
+        """Oldest undelivered events of a brand
+
+        Delivered events are deleted, so every row left is still due. An
+        event whose id was allocated before an already delivered one but
+        committed after it is picked up by a later batch instead of being
+        skipped, which a "past the last delivered id" cursor would do.
+        """
+        return db.execute(
+            select(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload, OutboxEvent.created_at)
+            .where(OutboxEvent.brand_id == brand_id)
+            .order_by(OutboxEvent.id)
+            .limit(limit)
+        ).all()
+
+    @staticmethod
+    def mark_delivered(db: Session, cursor: WebhookCursor, event_ids: List[int]) -> None:
+        """Drop exactly the events a brand has received and reset its retry state"""
+        for chunk in chunked(event_ids):
+            db.execute(OutboxEvent.__table__.delete().where(
+                OutboxEvent.brand_id == cursor.brand_id,
+                OutboxEvent.id.in_(chunk)
+            ))
+        cursor.last_event_id = max(cursor.last_event_id, *event_ids)
+        cursor.attempts = 0
+        cursor.next_attempt_at = None
+        cursor.last_error = None
+        cursor.updated_at = datetime.now(timezone.utc)
+        db.flush()
+
+    @staticmethod
+    def mark_failed(db: Session, cursor: WebhookCursor, error: str, retry_at: datetime) -> None:
+        """Record a failed delivery; the brand is skipped until `retry_at`"""
+        cursor.attempts += 1
+        cursor.next_attempt_at = retry_at
+        cursor.last_error = error[:500]
+        cursor.updated_at = datetime.now(timezone.utc)
+        db.flush()
+
+
+@instrument_crud
+class JobLeaseCRUD:
+    @staticmethod
+    def acquire(db: Session, name: str, owner: str, ttl_seconds: float) -> bool:
+        """Take or renew the lease on a periodic job; False while another worker holds it
+
+        The conditional UPDATE (held by us, or expired) is atomic, so two
+        workers never both win; the first run ever inserts the row.
+        """
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=ttl_seconds)
+        renewed = db.execute(
+            update(JobLease)
+            .where(JobLease.name == name, or_(JobLease.owner == owner, JobLease.expires_at < now))
+            .values(owner=owner, expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if renewed:
+            return True
+        try:
+            with db.begin_nested():
+                db.add(JobLease(name=name, owner=owner, expires_at=expires_at))
+        except IntegrityError:
+            return False  # Held by another worker
+        return True
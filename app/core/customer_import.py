@@ -0,0 +1,179 @@
+import csv
+import json
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Literal, Optional, Set, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.crud import BalanceCRUD, BrandCustomerCRUD, CustomerCRUD, TransactionCRUD, unit_of_work
+
+ImportFormat = Literal["csv", "ndjson"]
+
+PHONE_RE = re.compile(r"\d{10}")
+
+IMPORT_CHUNK_SIZE = 5000  # Rows per transaction
+
+
+@dataclass
+class ImportRow:
+    line: int
+    phone_number: str
+    brand_customer_id: str
+    initial_points: int = 0
+    reject: Optional[str] = None
+
+
+def _to_row(line: int, record: dict) -> ImportRow:
+    row = ImportRow(
+        line=line,
+        phone_number=str(record.get("phoneNumber") or "").strip(),
+        brand_customer_id=str(record.get("brandCustomerId") or "").strip(),
+    )
+    points = record.get("initialPoints")
+    try:
+        row.initial_points = int(points) if points not in (None, "") else 0
+    except (TypeError, ValueError):
+        row.reject = "invalid_points"
+    if row.initial_points < 0:
+        row.reject = "invalid_points"
+    if not row.brand_customer_id:
+        row.reject = "invalid_customer_id"
+    return row
+
+
+def parse_rows(lines: Iterable[str], fmt: ImportFormat) -> Iterator[ImportRow]:
+    """Parse (phoneNumber, brandCustomerId, initialPoints) records line by line
+
+    CSV input needs a header row (ValueError otherwise); initialPoints is
+    optional in both formats. Unreadable records come back as rejected rows.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        if not {"phoneNumber", "brandCustomerId"} <= set(reader.fieldnames or []):
+            raise ValueError("CSV header must include phoneNumber and brandCustomerId")
+        for record in reader:
+            yield _to_row(reader.line_num, record)
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            yield ImportRow(line=line_number, phone_number="", brand_customer_id="", reject="invalid_row")
+            continue
+        yield _to_row(line_number, record)
+
+
+def _import_chunk(db: Session, brand_id: str, rows: List[ImportRow],
+                  seen_phones: Set[str], seen_ids: Set[str]) -> Tuple[List[ImportRow], List[Optional[str]]]:
+    """Register the valid rows of one chunk that are new to the brand and to the file so far
+
+    Returns the imported rows and each row's reject reason (None when
+    imported).
+    """
+    # Validate phone numbers in one pass over the chunk
+    reasons = [
+        row.reject or (None if PHONE_RE.fullmatch(row.phone_number) else "invalid_phone")
+        for row in rows
+    ]
+    candidates = [row for row, reason in zip(rows, reasons) if reason is None]
+
+    # Duplicates against the brand's existing customers, with chunked set-based lookups
+    registered_phones = BrandCustomerCRUD.get_registered_phones(db, brand_id, (r.phone_number for r in candidates))
+    taken_ids = BrandCustomerCRUD.get_many_by_brand_customer_ids(
+        db, brand_id, (r.brand_customer_id for r in candidates)
+    )
+    # Initial-points entries whose ID a client used before the import: prefix was reserved
+    used_txn_ids = TransactionCRUD.get_existing_txn_ids(
+        db, brand_id, (TransactionCRUD.import_txn_id(r.brand_customer_id) for r in candidates if r.initial_points)
+    )
+
+    accepted = []
+    chunk_phones: Set[str] = set()
+    chunk_ids: Set[str] = set()
+    for index, row in enumerate(rows):
+        if reasons[index] is not None:
+            continue
+        if row.phone_number in registered_phones:
+            reasons[index] = "phone_already_registered"
+        elif row.brand_customer_id in taken_ids:
+            reasons[index] = "customer_id_already_used"
+        elif row.initial_points and TransactionCRUD.import_txn_id(row.brand_customer_id) in used_txn_ids:
+            reasons[index] = "txn_id_already_used"
+        elif (row.phone_number in seen_phones or row.phone_number in chunk_phones
+              or row.brand_customer_id in seen_ids or row.brand_customer_id in chunk_ids):
+            reasons[index] = "duplicate_in_file"
+        else:
+            chunk_phones.add(row.phone_number)
+            chunk_ids.add(row.brand_customer_id)
+            accepted.append(row)
+
+    # Insert customers, registrations, balances and initial-points ledger entries
+    CustomerCRUD.bulk_get_or_create(db, [row.phone_number for row in accepted])
+    BrandCustomerCRUD.bulk_create(db, brand_id, [
+        {"phone_number": row.phone_number, "brand_customer_id": row.brand_customer_id}
+        for row in accepted
+    ])
+    BalanceCRUD.bulk_credit(db, brand_id, {row.brand_customer_id: row.initial_points for row in accepted})
+    TransactionCRUD.bulk_create(db, brand_id, [
+        {"txn_id": TransactionCRUD.import_txn_id(row.brand_customer_id), "user_id": row.brand_customer_id,
+         "points": row.initial_points}
+        for row in accepted if row.initial_points
+    ], kind="import")
+    return accepted, reasons
+
+
+def import_customers(db: Session, brand_id: str, rows: Iterable[ImportRow],
+                     chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """Bulk-register customers to a brand, one transaction per chunk
+
+    A chunk that collides with a concurrent registration is rolled back
+    and retried once, so the colliding rows are reported as rejects.
+    Already committed chunks stay imported if a later one fails; running
+    the same file again rejects those rows as already registered.
+    """
+    seen_phones: Set[str] = set()
+    seen_ids: Set[str] = set()
+    imported = 0
+    rejects = []
+
+    def flush(chunk: List[ImportRow]) -> None:
+        nonlocal imported
+        for attempt in range(2):
+            try:
+                with unit_of_work(db):
+                    accepted, reasons = _import_chunk(db, brand_id, chunk, seen_phones, seen_ids)
+                break
+            except IntegrityError:
+                if attempt:
+                    raise
+        seen_phones.update(row.phone_number for row in accepted)
+        seen_ids.update(row.brand_customer_id for row in accepted)
+        imported += len(accepted)
+        rejects.extend(
+            {"line": row.line, "phoneNumber": row.phone_number,
+             "brandCustomerId": row.brand_customer_id, "reason": reason}
+            for row, reason in zip(chunk, reasons) if reason is not None
+        )
+
+    chunk: List[ImportRow] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    return {
+        "brandId": brand_id,
+        "imported": imported,
+        "rejected": len(rejects),
+        "rejects": rejects,
+    }
@@ -0,0 +1,111 @@
+import hashlib
+import time
+from dataclasses import dataclass
+from datetime import timezone
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.cache import idempotency_cache
+from app.core.config import settings
+from app.core.responses import json_dumps
+from app.core.crud import IdempotencyCRUD
+from app.db.group_commit import run_write
+from app.db.session import AnySession, run_db
+
+
+@dataclass(frozen=True)
+class IdempotentRequest:
+    """An incoming write request carrying an Idempotency-Key header"""
+    brand_id: str
+    key: str
+    fingerprint: str
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    response: str
+    expires_at: float  # time.time() timestamp
+
+
+def record_response(db: Session, request: Optional[IdempotentRequest], response: dict) -> dict:
+    """Store a handler's response for replay; call inside the handler's unit of work"""
+    if request is not None:
+        IdempotencyCRUD.create(
+            db, request.brand_id, request.key, request.fingerprint, 200, json_dumps(response).decode()
+        )
+    return response
+
+
+def _replay(request: IdempotentRequest, stored: StoredResponse) -> Response:
+    if stored.fingerprint != request.fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used with a different request"
+        )
+    # The stored body is already JSON; send it as is
+    return Response(
+        content=stored.response,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+def _load(db: Session, brand_id: str, key: str) -> Optional[StoredResponse]:
+    record = IdempotencyCRUD.get(db, brand_id, key)
+    if record is None:
+        return None
+    expires_at = record.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return StoredResponse(record.fingerprint, record.status_code, record.response, expires_at.timestamp())
+
+
+async def run_idempotent(db: AnySession, brand_id: str, key: Optional[str], route: str,
+                         body: BaseModel, handler: Callable[..., Any], *args: Any) -> Any:
+    """Run `handler(db, *args, request)` at most once per brand and Idempotency-Key
+
+    Without a key the handler simply runs. With a key, a stored response
+    is replayed straight from the front cache or the database, before any
+    brand, customer or transaction lookups. Otherwise the handler runs
+    and stores its response through `record_response` in the same
+    transaction as the write.
+    """
+    if key is None:
+        return await run_write(db, handler, *args, None)
+
+    fingerprint = hashlib.sha256(f"{route}\n{body.model_dump_json()}".encode()).hexdigest()
+    request = IdempotentRequest(brand_id=brand_id, key=key, fingerprint=fingerprint)
+    cache_key = (brand_id, key)
+
+    hit, stored = idempotency_cache.get(cache_key)
+    if hit and stored.expires_at > time.time():
+        return _replay(request, stored)
+
+    stored = await run_db(db, _load, brand_id, key)
+    if stored is not None:
+        idempotency_cache.put(cache_key, stored)
+        return _replay(request, stored)
+
+    try:
+        response = await run_write(db, handler, *args, request)
+    except (IntegrityError, HTTPException) as exc:
+        if isinstance(exc, HTTPException) and exc.status_code != 409:
+            raise
+        # A concurrent retry with the same key may have committed first
+        stored = await run_db(db, _load, brand_id, key)
+        if stored is None:
+            raise
+        return _replay(request, stored)
+
+    idempotency_cache.put(cache_key, StoredResponse(
+        fingerprint, 200, json_dumps(response).decode(), time.time() + settings.IDEMPOTENCY_TTL_SECONDS
+    ))
+    return response
@@ -0,0 +1,271 @@
+import collections
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.core.query_budget import check_request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 25, 50, 100)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(labels.items())
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(labels)} {value}" for labels, value in values)
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> ([count per bucket, +Inf last], sum)
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+http_requests = Counter("http_requests_total", "HTTP requests by route, method and status code")
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route", LATENCY_BUCKETS)
+request_queries = Histogram("http_request_db_queries", "SQL statements per HTTP request by route",
+                            QUERY_COUNT_BUCKETS)
+request_db_time = Histogram("http_request_db_seconds", "Time spent in SQL per HTTP request by route",
+                            LATENCY_BUCKETS)
+db_queries = Counter("db_queries_total", "SQL statements by CRUD method")
+db_time = Counter("db_query_seconds_total", "Time spent in SQL by CRUD method")
+db_commits = Counter("db_commits_total", "Committed database transactions")
+db_rollbacks = Counter("db_rollbacks_total", "Rolled back database transactions")
+
+METRICS = [http_requests, http_latency, request_queries, request_db_time, db_queries, db_time,
+           db_commits, db_rollbacks]
+
+
+# Engine and CRUD hooks are installed for /metrics and for the query debug mode
+ENABLED = settings.METRICS_ENABLED or settings.QUERY_DEBUG
+
+
+class RequestStats:
+    """SQL activity of one request, shared with the threads and greenlets serving it"""
+    __slots__ = ("queries", "db_time", "commits", "statements")
+
+    def __init__(self, track_statements: bool = False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.commits = 0
+        # (CRUD method, statement) -> executions, for N+1 detection
+        self.statements: Optional[collections.Counter] = collections.Counter() if track_statements else None
+
+
+# Set by the middleware and copied into threadpool calls, AsyncSession.run_sync and
+# group-commit jobs. A group-commit batch's shared COMMIT is only counted globally.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+current_crud_method: ContextVar[str] = ContextVar("current_crud_method", default="other")
+
+
+def instrument_crud(cls: type) -> type:
+    """Class decorator attributing SQL run inside each static method to `Class.method`
+
+    Nested CRUD calls are attributed to the innermost method. A no-op when
+    metrics and query debugging are disabled.
+    """
+    if not ENABLED:
+        return cls
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod):
+            setattr(cls, name, staticmethod(_tag(f"{cls.__name__}.{name}", attr.__func__)))
+    return cls
+
+
+def _tag(label: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    if inspect.isgeneratorfunction(fn):
+        # Tag each step: streaming responses may resume the generator in another context
+        @functools.wraps(fn)
+        def generator(*args, **kwargs):
+            steps = fn(*args, **kwargs)
+            try:
+                while True:
+                    token = current_crud_method.set(label)
+                    try:
+                        item = next(steps)
+                    except StopIteration:
+                        return
+                    finally:
+                        current_crud_method.reset(token)
+                    yield item
+            finally:
+                steps.close()
+        return generator
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_crud_method.set(label)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_crud_method.reset(token)
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    method = current_crud_method.get()
+    db_queries.inc(method=method)
+    db_time.inc(elapsed, method=method)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None:
+            stats.statements[(method, statement)] += 1
+
+
+def _on_commit(conn) -> None:
+    db_commits.inc()
+    stats = current_request.get()
+    if stats is not None:
+        stats.commits += 1
+
+
+def _on_rollback(conn) -> None:
+    db_rollbacks.inc()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record statement counts, SQL time and commits of a (sync) engine; a no-op when disabled"""
+    if not ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "commit", _on_commit)
+    event.listen(engine, "rollback", _on_rollback)
+
+
+def route_label(scope: dict) -> str:
+    """The matched route's path template, e.g. "/brands/{brand_id}/earn"; "unmatched" if none
+
+    Templates keep label cardinality bounded. Routes of included routers
+    may only carry the part after the router's prefix, so the (literal)
+    prefix is taken from the request path.
+    """
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    segments = scope["path"].split("/")
+    return "/".join(segments[:len(segments) - template.count("/")]) + template
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status codes and SQL activity per route
+
+    In QUERY_DEBUG mode it also adds X-DB-Queries / X-DB-Commits / X-DB-Time
+    response headers, logs probable N+1 queries and enforces query budgets.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(track_statements=settings.QUERY_DEBUG)
+        token = current_request.set(stats)
+        status = {"code": 500}
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if settings.QUERY_DEBUG:
+                    headers = check_request(scope["method"], route_label(scope), stats)
+                    message = {**message, "headers": [*message.get("headers", []), *headers]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            route = route_label(scope)
+            http_requests.inc(route=route, method=scope["method"], status=str(status["code"]))
+            http_latency.observe(elapsed, route=route)
+            request_queries.observe(stats.queries, route=route)
+            request_db_time.observe(stats.db_time, route=route)
+
+
+def render_metrics(extra: Iterable[str] = ()) -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
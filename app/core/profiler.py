@@ -0,0 +1,194 @@
+import collections
+import functools
+import hmac
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+from app.core.metrics import route_label
+
+
+class RequestProfile:
+    """Stack samples of one profiled request"""
+
+    def __init__(self, anchor: FrameType, loop_thread: int):
+        self.anchor = anchor  # The middleware's frame: samples of the event loop thread below it are ours
+        self.loop_thread = loop_thread
+        self.threads: collections.Counter = collections.Counter()  # Worker threads running our DB code
+        self.samples: collections.Counter = collections.Counter()  # Collapsed stack -> samples
+        self.generation = 0  # Sampler resets seen when the request started
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+def _tracked(profile: RequestProfile, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    ident = threading.get_ident()
+    profile.threads[ident] += 1
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.threads[ident] -= 1
+        if not profile.threads[ident]:
+            del profile.threads[ident]
+
+
+_TRACKED_CODE = _tracked.__code__
+
+
+def track(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap `fn` so the thread running it is sampled for the current request, if profiled
+
+    Used where the app hands work to another thread (`run_db`, group commit).
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return fn
+    return functools.partial(_tracked, profile, fn)
+
+
+class StackSampler:
+    """Samples the stacks of profiled requests every `interval` seconds and aggregates them per route
+
+    The sampling thread only runs while profiled requests are in flight.
+    Each stack is cut at the request's entry point (the middleware on the
+    event loop, the `track` wrapper in worker threads) and stored in
+    collapsed-stack form, ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.requests: collections.Counter = collections.Counter()
+        self._active: Set[RequestProfile] = set()
+        self._labels: Dict[CodeType, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._generation = 0
+
+    def begin(self, profile: RequestProfile) -> None:
+        with self._lock:
+            profile.generation = self._generation
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def end(self, profile: RequestProfile, route: str) -> None:
+        with self._lock:
+            self._active.discard(profile)
+            if profile.generation != self._generation:
+                return  # Started before a reset (e.g. the DELETE /admin/profiles request itself)
+            self.requests[route] += 1
+            self.stacks[route].update(profile.samples)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for profile in self._active:
+                    self._sample(profile, frames)
+
+    def _sample(self, profile: RequestProfile, frames: Dict[int, FrameType]) -> None:
+        loop_frame = frames.get(profile.loop_thread)
+        if loop_frame is not None:
+            stack = self._collapse(loop_frame, lambda frame: frame is profile.anchor)
+            if stack is not None:
+                profile.samples[stack] += 1
+        for ident in list(profile.threads):
+            frame = frames.get(ident)
+            if frame is not None:
+                stack = self._collapse(frame, lambda frame: frame.f_code is _TRACKED_CODE)
+                if stack is not None:
+                    profile.samples[stack] += 1
+
+    def _collapse(self, frame: FrameType, is_root: Callable[[FrameType], bool]) -> Optional[str]:
+        """Frames from just below the root frame to the leaf, joined by ';'; None if the root is not on the stack"""
+        labels = []
+        while frame is not None:
+            if is_root(frame):
+                labels.reverse()
+                return ";".join(labels) or "[self]"
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                module = frame.f_globals.get("__name__", "?")
+                label = self._labels[code] = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+            labels.append(label)
+            frame = frame.f_back
+        return None
+
+    def render(self, route: Optional[str] = None) -> str:
+        """Collapsed stacks (`route;frame;...;frame count`), most sampled first"""
+        with self._lock:
+            lines = [
+                (count, f"{name};{stack}")
+                for name, stacks in self.stacks.items() if route is None or name == route
+                for stack, count in stacks.items()
+            ]
+        lines.sort(key=lambda line: line[0], reverse=True)
+        return "".join(f"{stack} {count}\n" for count, stack in lines)
+
+    def reset(self) -> None:
+        """Drop the collected stacks, including those of requests still in flight"""
+        with self._lock:
+            self._generation += 1
+            self.stacks.clear()
+            self.requests.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "profiledRequests": dict(self.requests),
+                "samples": {name: sum(stacks.values()) for name, stacks in self.stacks.items()},
+            }
+
+
+sampler = StackSampler(settings.PROFILER_INTERVAL_MS / 1000)
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """Whether `token` matches PROFILER_TOKEN (never true when no token is configured)"""
+    if not settings.PROFILER_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), settings.PROFILER_TOKEN.encode())
+
+
+class ProfilerMiddleware:
+    """ASGI middleware profiling PROFILER_SAMPLE_RATE of requests, plus any with a valid X-Profile header
+
+    Only installed when PROFILER_ENABLED is set. Sync route handlers run in
+    the threadpool outside `run_db` and are not sampled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _should_profile(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return is_authorized(value.decode("latin-1"))
+        return random.random() < settings.PROFILER_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(sys._getframe(), threading.get_ident())
+        token = current_profile.set(profile)
+        sampler.begin(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_profile.reset(token)
+            sampler.end(profile, f"{scope['method']} {route_label(scope)}")
@@ -0,0 +1,75 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    queries: Optional[int] = None  # SQL statements per request
+    commits: Optional[int] = None
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more SQL statements or commits than its route's budget allows"""
+
+
+_budgets: Dict[Tuple[str, str], QueryBudget] = {}
+
+
+def declare_query_budget(method: str, route: str, queries: Optional[int] = None,
+                         commits: Optional[int] = None) -> None:
+    """Fail requests to `method route` that run more statements or commits than given
+
+    `route` is the route template, e.g. "/brands/{brand_id}/earn". Budgets
+    are checked in QUERY_DEBUG mode just before the response is sent, so
+    the request fails with QueryBudgetExceeded (a test client re-raises it).
+    With group commit the shared batch COMMIT is not counted per request.
+    """
+    _budgets[(method.upper(), route)] = QueryBudget(queries, commits)
+
+
+def clear_query_budgets() -> None:
+    _budgets.clear()
+
+
+def repeated_statements(statements: Dict[Tuple[str, str], int], threshold: int) -> List[Tuple[str, str, int]]:
+    """(CRUD method, statement, count) of statement shapes run at least `threshold` times, most repeated first"""
+    repeated = [(method, statement, count) for (method, statement), count in statements.items() if count >= threshold]
+    return sorted(repeated, key=lambda item: item[2], reverse=True)
+
+
+def check_request(method: str, route: str, stats) -> List[Tuple[bytes, bytes]]:
+    """Debug headers for a handled request; logs probable N+1 queries and enforces the route's budget
+
+    Statements run with different parameters share one shape, so the same
+    shape repeated QUERY_N_PLUS_ONE_THRESHOLD times within a request is
+    reported as a probable N+1.
+    """
+    headers = [
+        (b"x-db-queries", str(stats.queries).encode()),
+        (b"x-db-commits", str(stats.commits).encode()),
+        (b"x-db-time", f"{stats.db_time * 1000:.2f}ms".encode()),
+    ]
+
+    repeated = repeated_statements(stats.statements, settings.QUERY_N_PLUS_ONE_THRESHOLD)
+    if repeated:
+        headers.append((b"x-db-n-plus-one", str(repeated[0][2]).encode()))
+        for crud_method, statement, count in repeated:
+            logger.warning("Probable N+1 in %s %s: %s ran the same statement %d times: %s",
+                           method, route, crud_method, count, " ".join(statement.split())[:200])
+
+    budget = _budgets.get((method, route))
+    if budget is not None:
+        if budget.queries is not None and stats.queries > budget.queries:
+            raise QueryBudgetExceeded(
+                f"{method} {route} ran {stats.queries} SQL statements, budget is {budget.queries}"
+            )
+        if budget.commits is not None and stats.commits > budget.commits:
+            raise QueryBudgetExceeded(
+                f"{method} {route} committed {stats.commits} times, budget is {budget.commits}"
+            )
+    return headers
@@ -0,0 +1,43 @@
+import json
+from typing import Any, Mapping, Optional
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
+
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library encoder is used instead
+    orjson = None
+
+
+def json_dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, through orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when installed; the app's default response class"""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+def fast_response(content: Any, adapter: Optional[TypeAdapter] = None, status_code: int = 200,
+                  headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Render a handler's JSON-ready result (plain dicts, lists and strings) straight to bytes
+
+    Returning a Response makes FastAPI skip `jsonable_encoder` and the
+    route's `response_model` validation, which re-checks data the handler
+    has just built; `response_model` still documents the route. With
+    RESPONSE_VALIDATION on (tests), the content is checked against
+    `adapter` instead. Responses (e.g. idempotent replays) pass through.
+    """
+    if isinstance(content, Response):
+        return content
+    if adapter is not None and settings.RESPONSE_VALIDATION:
+        adapter.validate_python(content)
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
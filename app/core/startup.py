@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from sqlalchemy import inspect as inspect_db
+from sqlalchemy.pool import QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import brand_registry
+from app.core.config import settings
+from app.db.base import Base
+from app.db.migrate import pending_upgrades, upgrade_schema
+from app.db.session import SessionLocal, async_engine, async_read_engine, engine, read_engine
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, for tracking cold-start latency
+
+    Dotted phases ("preload.brands") run concurrently inside their parent
+    and are not added to the total.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def total(self) -> float:
+        return sum(seconds for name, seconds in self.phases.items() if "." not in name)
+
+    def log(self) -> None:
+        logger.info("Startup (%s mode) took %.1fms: %s", settings.STARTUP_MODE, self.total() * 1000,
+                    ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.phases.items()))
+
+    def stats(self) -> dict:
+        return {
+            "mode": settings.STARTUP_MODE,
+            "totalMs": round(self.total() * 1000, 1),
+            "phasesMs": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+    def render(self) -> List[str]:
+        """Prometheus gauge lines for /metrics"""
+        lines = ["# HELP app_startup_seconds Worker startup time by phase",
+                 "# TYPE app_startup_seconds gauge"]
+        lines.extend(f'app_startup_seconds{{phase="{name}"}} {seconds}' for name, seconds in self.phases.items())
+        return lines
+
+
+startup_timer = StartupTimer()
+
+
+def create_schema() -> List[str]:
+    """Create missing tables and upgrade existing ones; returns the upgrades applied"""
+    Base.metadata.create_all(bind=engine)
+    return upgrade_schema(engine)
+
+
+def seed() -> None:
+    """Insert the sample brands into an empty database"""
+    from app.db.init_db import init_db  # Only needed by `manage.py init` and development startup
+
+    db = SessionLocal()
+    try:
+        init_db(db)
+    finally:
+        db.close()
+
+
+def check_schema() -> None:
+    """Fail fast when the database has not been initialized or upgraded (production startup)"""
+    with engine.connect() as conn:
+        existing = set(inspect_db(conn).get_table_names())
+        pending = pending_upgrades(conn)
+    missing = sorted(set(Base.metadata.tables) - existing)
+    if missing:
+        raise RuntimeError(f"Database is missing tables {', '.join(missing)}; run `python manage.py init` first")
+    if pending:
+        raise RuntimeError(f"Database schema is out of date ({'; '.join(pending)}); run `python manage.py migrate` first")
+
+
+def load_brands() -> None:
+    db = SessionLocal()
+    try:
+        brand_registry.load(db)
+    finally:
+        db.close()
+
+
+def warm_pool(pooled_engine) -> None:
+    """Open the pool's steady-state connections up front, running their connect hooks (PRAGMAs)"""
+    if not isinstance(pooled_engine.pool, QueuePool):
+        return
+    connections = []
+    try:
+        for _ in range(pooled_engine.pool.size()):
+            connections.append(pooled_engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def warm_async_pool(pooled_engine) -> None:
+    connections = []
+    try:
+        for _ in range(pooled_engine.pool.size()):
+            connections.append(await pooled_engine.connect())
+    finally:
+        for connection in connections:
+            await connection.close()
+
+
+async def preload(timer: StartupTimer) -> None:
+    """Warm the brand cache and connection pools concurrently, timing each"""
+
+    async def timed(name: str, job) -> None:
+        with timer.phase(f"preload.{name}"):
+            if inspect.iscoroutinefunction(job):
+                await job()
+            else:
+                await run_in_threadpool(job)
+
+    jobs = [timed("pool", functools.partial(warm_pool, engine))]
+    if settings.BRAND_CACHE_ENABLED:
+        jobs.append(timed("brands", load_brands))
+    if async_engine is not None and isinstance(async_engine.pool, QueuePool):
+        jobs.append(timed("asyncPool", functools.partial(warm_async_pool, async_engine)))
+    if read_engine is not None:
+        jobs.append(timed("readPool", functools.partial(warm_pool, read_engine)))
+    if async_read_engine is not None and isinstance(async_read_engine.pool, QueuePool):
+        jobs.append(timed("asyncReadPool", functools.partial(warm_async_pool, async_read_engine)))
+    await asyncio.gather(*jobs)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from functools import partial
+from typing import Any, List, Optional
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.background import LEASE_INTERVALS, WORKER_ID, run_job
+from app.core.config import settings
+from app.core.crud import JobLeaseCRUD, OutboxCRUD
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Delivery:
+    """One brand's batch of outbox events and the outcome of posting it"""
+    brand_id: str
+    url: str
+    events: List[dict]
+    error: Optional[str] = None
+
+    @property
+    def last_event_id(self) -> int:
+        return self.events[-1]["id"]
+
+    @property
+    def event_ids(self) -> List[int]:
+        return [event["id"] for event in self.events]
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class WebhookDispatcher:
+    """Drains the outbox table and posts events to each brand's webhook
+
+    Every tick claims a brand's `batch_size` oldest events and posts them
+    as one request, brands in parallel, over a shared keep-alive HTTP
+    client. A successful post deletes exactly the delivered events and
+    resets the brand's retry state in one transaction; a failure
+    leaves them in place and backs the brand off exponentially, without
+    holding up other brands. Every worker starts a dispatcher, but only
+    the one holding the "webhook dispatch" lease delivers. Delivery is
+    at-least-once: receivers should de-duplicate on event IDs.
+    """
+
+    def __init__(self, batch_size: int, timeout_seconds: float, max_backoff_seconds: float):
+        self.batch_size = batch_size
+        self.timeout_seconds = timeout_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._client: Any = None
+        self.requests = 0
+        self.delivered = 0
+        self.failures = 0
+        self.skipped = 0
+
+    async def start(self) -> None:
+        import httpx  # Only needed when webhooks are configured
+
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout_seconds,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _claim(self, db: Session) -> List[Delivery]:
+        now = datetime.now(timezone.utc)
+        cursors = OutboxCRUD.get_cursors(db, OutboxCRUD.pending_brand_ids(db))
+        deliveries = []
+        for brand_id, cursor in cursors.items():
+            url = OutboxCRUD.webhook_url(brand_id)
+            retry_at = _as_utc(cursor.next_attempt_at)
+            if url is None or (retry_at is not None and retry_at > now):
+                continue
+            rows = OutboxCRUD.get_batch(db, brand_id, self.batch_size)
+            if rows:
+                deliveries.append(Delivery(brand_id, url, [
+                    {
+                        "id": row.id,
+                        "type": row.event_type,
+                        "occurredAt": _as_utc(row.created_at).isoformat(),
+                        "data": json.loads(row.payload),
+                    }
+                    for row in rows
+                ]))
+        return deliveries
+
+    async def _post(self, delivery: Delivery) -> None:
+        try:
+            response = await self._client.post(
+                delivery.url,
+                json={"brandId": delivery.brand_id, "events": delivery.events},
+                headers={"X-Webhook-Delivery": f"{delivery.brand_id}:{delivery.last_event_id}"},
+            )
+            if response.status_code >= 300:
+                delivery.error = f"HTTP {response.status_code}"
+        except Exception as exc:
+            delivery.error = f"{type(exc).__name__}: {exc}"
+
+    def _record(self, deliveries: List[Delivery], db: Session) -> None:
+        now = datetime.now(timezone.utc)
+        cursors = OutboxCRUD.get_cursors(db, (d.brand_id for d in deliveries))
+        for delivery in deliveries:
+            cursor = cursors[delivery.brand_id]
+            if delivery.error is None:
+                OutboxCRUD.mark_delivered(db, cursor, delivery.event_ids)
+                continue
+            # Exponential backoff with jitter, capped at max_backoff_seconds
+            delay = min(2 ** cursor.attempts, self.max_backoff_seconds) * random.uniform(0.5, 1.0)
+            OutboxCRUD.mark_failed(db, cursor, delivery.error, now + timedelta(seconds=delay))
+            logger.warning("Webhook delivery to brand %s failed: %s", delivery.brand_id, delivery.error)
+
+    async def dispatch_once(self) -> bool:
+        """Deliver one batch per brand; returns True if any brand may have more waiting"""
+        deliveries = await run_in_threadpool(run_job, self._claim)
+        if not deliveries:
+            return False
+        await asyncio.gather(*(self._post(delivery) for delivery in deliveries))
+        await run_in_threadpool(run_job, partial(self._record, deliveries))
+
+        for delivery in deliveries:
+            self.requests += 1
+            if delivery.error is None:
+                self.delivered += len(delivery.events)
+            else:
+                self.failures += 1
+        return any(d.error is None and len(d.events) == self.batch_size for d in deliveries)
+
+    async def run(self, interval_seconds: float) -> None:
+        """Dispatch until cancelled, draining backlogs without waiting between full batches
+
+        The lease is renewed before every dispatch and outlives a slow
+        delivery, so two workers never post the same batch.
+        """
+        acquire_lease = partial(
+            JobLeaseCRUD.acquire, name="webhook dispatch", owner=WORKER_ID,
+            ttl_seconds=interval_seconds * LEASE_INTERVALS + self.timeout_seconds,
+        )
+        while True:
+            more = False
+            try:
+                if await run_in_threadpool(run_job, acquire_lease):
+                    more = await self.dispatch_once()
+                else:
+                    self.skipped += 1
+            except Exception:
+                logger.exception("Webhook dispatch failed")
+            if not more:
+                await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "delivered": self.delivered,
+            "failures": self.failures,
+            "skipped": self.skipped,
+        }
+
+
+webhook_dispatcher: Optional[WebhookDispatcher] = None
+if settings.WEBHOOK_URLS:
+    webhook_dispatcher = WebhookDispatcher(
+        batch_size=settings.WEBHOOK_BATCH_SIZE,
+        timeout_seconds=settings.WEBHOOK_TIMEOUT_SECONDS,
+        max_backoff_seconds=settings.WEBHOOK_MAX_BACKOFF_SECONDS,
+    )
@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import settings
+from app.core.metrics import instrument_engine
+from app.core.profiler import track
+from app.db.pool import is_memory_sqlite
+from app.db.session import AnySession, SessionLocal, apply_sqlite_pragmas, is_sqlite, run_db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+WriteJob = Tuple[Callable[..., Any], tuple, Future, contextvars.Context]
+
+
+class GroupCommitWriter:
+    """Single writer thread that commits many write requests in one transaction
+
+    SQLite allows one writer at a time, so concurrent requests otherwise
+    queue on the database lock and each pays for its own commit. Here
+    requests arriving within `window_seconds` (up to `max_batch`) are run
+    one after another in a shared session, each inside a SAVEPOINT so a
+    failing request only rolls back its own changes, and the batch is
+    committed once. Every caller is resolved after that commit.
+    """
+
+    def __init__(self, session_factory: sessionmaker, window_seconds: float, max_batch: int):
+        self.session_factory = session_factory
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.writes = 0
+
+    @property
+    def engine(self) -> Engine:
+        """Engine the writer's sessions are bound to (its own connection on file SQLite)"""
+        return self.session_factory.kw["bind"]
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Finish queued writes and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Queue `fn(session, *args)`; the future resolves once its batch is committed
+
+        `fn` runs in a copy of the caller's context, so per-request state
+        such as metrics follows it into the writer thread.
+        """
+        future: Future = Future()
+        self._queue.put((fn, args, future, contextvars.copy_context()))
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _collect(self, first: WriteJob) -> Tuple[List[WriteJob], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect(first)
+            self._apply(batch)
+
+    def _apply(self, batch: List[WriteJob]) -> None:
+        # A fresh session per batch, so no stale objects carry over between batches
+        db: Session = self.session_factory()
+        db.info["group_commit"] = True
+        results = []
+        try:
+            for fn, args, future, context in batch:
+                # Skip requests whose caller has gone away (e.g. a cancelled task)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    results.append((future, context.run(fn, db, *args), None))
+                except Exception as exc:
+                    results.append((future, None, exc))
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Group commit of %d writes failed", len(batch))
+            for future, _, _ in results:
+                future.set_exception(exc)
+            return
+        finally:
+            db.close()
+
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, exc in results:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "writes": self.writes,
+            "avgBatchSize": round(self.writes / self.batches, 2) if self.batches else 0,
+            "queued": self._queue.qsize(),
+        }
+
+
+def writer_session_factory() -> sessionmaker:
+    """Sessions for the writer thread
+
+    On file SQLite the writer gets its own connection that opens every
+    batch with BEGIN IMMEDIATE. By default the batch's first SAVEPOINT
+    starts a deferred transaction, and its first write then fails with
+    "database is locked" (without waiting for busy_timeout) whenever
+    another connection, e.g. a customer registration, has written since
+    the batch's first read. Taking the write lock up front waits instead.
+    """
+    url = settings.DATABASE_URL
+    if not is_sqlite(url) or is_memory_sqlite(url):
+        return SessionLocal
+
+    writer_engine = create_engine(url, connect_args={"check_same_thread": False}, pool_size=1, max_overflow=0)
+
+    @event.listens_for(writer_engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        if settings.SQLITE_TUNING_ENABLED:
+            apply_sqlite_pragmas(dbapi_connection, connection_record)
+        # Let SQLAlchemy emit BEGIN itself (below) instead of the driver
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer_engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    instrument_engine(writer_engine)
+
+    return sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=writer_engine)
+
+
+group_writer: Optional[GroupCommitWriter] = None
+if settings.GROUP_COMMIT_ENABLED:
+    group_writer = GroupCommitWriter(
+        writer_session_factory(),
+        window_seconds=settings.GROUP_COMMIT_WINDOW_MS / 1000,
+        max_batch=settings.GROUP_COMMIT_MAX_BATCH,
+    )
+
+
+async def run_write(db: AnySession, fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a write handler `fn(session, *args)`, through the group-commit writer when enabled"""
+    if group_writer is not None:
+        return await group_writer.run(track(fn) if settings.PROFILER_ENABLED else fn, *args)
+    return await run_db(db, fn, *args)
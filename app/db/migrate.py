@@ -0,0 +1,136 @@
+"""In-place upgrades for databases created by earlier versions
+
+`Base.metadata.create_all` only adds missing tables. Changes to existing
+tables are listed in UPGRADES and applied, together with any missing
+indexes, by `python manage.py init` / `python manage.py migrate` (and by
+development startup). Production workers refuse to start while one is
+pending, see `app.core.startup.check_schema`.
+"""
+import logging
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Connection, Inspector, MetaData, Table, case, inspect, select, text
+from sqlalchemy.engine import Engine
+
+from app.db.base import Base
+from app.models import OutboxEvent, Provision, Transaction
+
+logger = logging.getLogger(__name__)
+
+
+class Upgrade(NamedTuple):
+    table: str
+    description: str
+    needed: Callable[[Inspector], bool]
+    apply: Callable[[Connection], None]
+
+
+def _missing_column(table: str, column: str) -> Callable[[Inspector], bool]:
+    def needed(inspector: Inspector) -> bool:
+        return inspector.has_table(table) and column not in {c["name"] for c in inspector.get_columns(table)}
+    return needed
+
+
+def _missing_sqlite_autoincrement(table: str) -> Callable[[Inspector], bool]:
+    def needed(inspector: Inspector) -> bool:
+        if inspector.dialect.name != "sqlite" or not inspector.has_table(table):
+            return False
+        sql = inspector.bind.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+        ).scalar()
+        return "AUTOINCREMENT" not in sql.upper()
+    return needed
+
+
+def _rebuild_transactions(conn: Connection) -> None:
+    """Copy the ledger into the current layout (SQLite cannot change a primary key in place)
+
+    Entries get their `seq` in (created_at, id) order. Before the ledger
+    was append-only, redemptions were stored as negative earns and voided
+    entries were deleted, so every old row is an earn or a redeem.
+    """
+    old = Table("transactions", MetaData(), autoload_with=conn)
+    for index in old.indexes:
+        index.drop(conn)  # The new table's indexes reuse the names
+    new = Transaction.__table__.to_metadata(MetaData(), name="transactions_upgraded")
+    new.create(conn)
+    conn.execute(new.insert().from_select(
+        ["id", "txn_id", "brand_id", "user_id", "points", "kind", "created_at"],
+        select(old.c.id, old.c.txn_id, old.c.brand_id, old.c.user_id, old.c.points,
+               case((old.c.points < 0, "redeem"), else_="earn"), old.c.created_at)
+        .order_by(old.c.created_at, old.c.id)
+    ))
+    old.drop(conn)
+    conn.execute(text("ALTER TABLE transactions_upgraded RENAME TO transactions"))
+
+
+def _add_provision_status(conn: Connection) -> None:
+    """Fully used provisions used to be deleted, so existing rows are active
+
+    The sweeper refunds the ones that have already expired on its next run.
+    """
+    conn.execute(text("ALTER TABLE provisions ADD COLUMN status VARCHAR NOT NULL DEFAULT 'active'"))
+    provisions = Provision.__table__
+    conn.execute(provisions.update().where(provisions.c.remaining_points == 0).values(status="redeemed"))
+
+
+def _rebuild_outbox(conn: Connection) -> None:
+    """Recreate the outbox with AUTOINCREMENT so ids of delivered (deleted) events are not reused"""
+    old = Table("outbox_events", MetaData(), autoload_with=conn)
+    for index in old.indexes:
+        index.drop(conn)
+    new = OutboxEvent.__table__.to_metadata(MetaData(), name="outbox_events_upgraded")
+    new.create(conn)
+    columns = [column.name for column in new.columns]
+    conn.execute(new.insert().from_select(columns, select(*(old.c[name] for name in columns))))
+    old.drop(conn)
+    conn.execute(text("ALTER TABLE outbox_events_upgraded RENAME TO outbox_events"))
+
+
+UPGRADES = [
+    Upgrade("transactions", "transactions: append-only ledger (seq primary key, kind, reverses_txn_id)",
+            _missing_column("transactions", "seq"), _rebuild_transactions),
+    Upgrade("provisions", "provisions: status column",
+            _missing_column("provisions", "status"), _add_provision_status),
+    Upgrade("outbox_events", "outbox_events: AUTOINCREMENT ids (SQLite)",
+            _missing_sqlite_autoincrement("outbox_events"), _rebuild_outbox),
+]
+
+
+def _missing_indexes(inspector: Inspector, skip_tables=()) -> list:
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name in skip_tables or not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+
+def pending_upgrades(conn: Connection) -> List[str]:
+    """Descriptions of what `create_schema` would still change, new tables included"""
+    inspector = inspect(conn)
+    pending = [upgrade for upgrade in UPGRADES if upgrade.needed(inspector)]
+    rebuilt = {upgrade.table for upgrade in pending}
+    return [f"{name}: new table" for name in Base.metadata.tables if not inspector.has_table(name)] + [
+        upgrade.description for upgrade in pending
+    ] + [f"{index.table.name}: index {index.name}" for index in _missing_indexes(inspector, rebuilt)]
+
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    """Apply pending upgrades in one transaction; returns their descriptions"""
+    applied = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite runs DDL outside a transaction unless one is already open
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        for upgrade in UPGRADES:
+            if upgrade.needed(inspect(conn)):
+                logger.info("Upgrading %s", upgrade.description)
+                upgrade.apply(conn)
+                applied.append(upgrade.description)
+        for index in _missing_indexes(inspect(conn)):
+            logger.info("Creating index %s on %s", index.name, index.table.name)
+            index.create(conn)
+            applied.append(f"{index.table.name}: index {index.name}")
+    return applied
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool, StaticPool
+
+from app.core.config import settings
+
+
+class PoolWaitStats:
+    """Running totals of how long checkouts waited for a pooled connection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            if seconds > self.max_wait:
+                self.max_wait = seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            avg = self.total_wait / self.checkouts if self.checkouts else 0.0
+            return {
+                "checkouts": self.checkouts,
+                "waitTotalMs": round(self.total_wait * 1000, 3),
+                "waitAvgMs": round(avg * 1000, 3),
+                "waitMaxMs": round(self.max_wait * 1000, 3),
+            }
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+class _TimedCheckout:
+    """Pool mixin recording the time spent waiting for each checkout"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait_stats.record(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def is_memory_sqlite(url: str) -> bool:
+    """Whether a SQLite URL points at an in-memory database"""
+    parsed = make_url(url)
+    return parsed.database in (None, "", ":memory:") or parsed.query.get("mode") == "memory"
+
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """create_engine() keyword arguments for the pool that suits `url`
+
+    - in-memory SQLite: one shared connection (StaticPool), otherwise every
+      checkout would see a different, empty database
+    - file SQLite: a bounded queue pool, or no pooling with SQLITE_POOL=null
+    - server databases: sized queue pool with pre-ping and recycling
+    """
+    queue_pool = TimedAsyncQueuePool if is_async else TimedQueuePool
+    sized = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
+    if url.startswith("sqlite"):
+        options = {"connect_args": {"check_same_thread": False}}  # Needed for SQLite
+        if is_memory_sqlite(url):
+            options["poolclass"] = StaticPool
+        elif settings.SQLITE_POOL == "null":
+            options["poolclass"] = NullPool
+        else:
+            options.update(sized, poolclass=queue_pool)
+        return options
+
+    return dict(
+        sized,
+        poolclass=queue_pool,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
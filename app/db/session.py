@@ -1,13 +1,63 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Optional
+
+from fastapi import Header
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, Session
+from starlette.concurrency import run_in_threadpool
 from app.core.config import settings
+from app.core.consistency import requires_primary
+from app.core.metrics import instrument_engine
+from app.core.profiler import track
+from app.db.pool import engine_options, pool_wait_stats
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Needed for SQLite
-)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def is_sqlite(url: str) -> bool:
+    """Whether a database URL points at SQLite"""
+    return url.startswith("sqlite")
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Apply the SQLite performance profile from settings to a new connection
+
+    WAL lets readers run alongside the single writer and, with
+    synchronous=NORMAL, commits no longer fsync on every transaction.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.SQLITE_CACHE_SIZE)}")
+        cursor.execute(f"PRAGMA temp_store={settings.SQLITE_TEMP_STORE}")
+    finally:
+        cursor.close()
+
+
+def make_engine(url: str):
+    """Engine for `url` with the app's pool, SQLite profile and metrics"""
+    new_engine = create_engine(url, **engine_options(url))
+    if is_sqlite(url) and settings.SQLITE_TUNING_ENABLED:
+        event.listen(new_engine, "connect", apply_sqlite_pragmas)
+    instrument_engine(new_engine)
+    return new_engine
+
+
+engine = make_engine(settings.DATABASE_URL)
+
+# Objects stay loaded after the single unit-of-work commit, so responses
+# can be built without re-selecting every row
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Optional read replica, used by read-only routes through get_read_db / get_read_session
+read_engine = None
+ReadSessionLocal = None
+
+if settings.READ_DATABASE_URL:
+    read_engine = make_engine(settings.READ_DATABASE_URL)
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=read_engine,
+                                    info={"replica": True})
 
 
 def get_db():
@@ -17,3 +67,128 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def use_replica(consistency_token: Optional[str]) -> bool:
+    """Whether a read can go to the replica: one is configured and the client has not written recently"""
+    return ReadSessionLocal is not None and not requires_primary(consistency_token)
+
+
+ConsistencyToken = Header(
+    None, alias="X-Consistency-Token",
+    description="X-Consistency-Token of the client's last write; recent tokens read from the primary"
+)
+
+
+def get_read_db(x_consistency_token: Optional[str] = ConsistencyToken):
+    """Dependency for read-only routes: a replica session, or a primary one for read-your-writes"""
+    db = ReadSessionLocal() if use_replica(x_consistency_token) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync DATABASE_URL to its async driver (aiosqlite / asyncpg)"""
+    for prefix, async_prefix in (
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+    ):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+# Session in sync mode, AsyncSession when DB_ASYNC is enabled; only `run_db` uses it
+AnySession = Any
+
+async_engine = None
+AsyncSessionLocal = None
+
+async_read_engine = None
+AsyncReadSessionLocal = None
+
+if settings.DB_ASYNC:
+    # Imported lazily so the async drivers are only required in async mode
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    def make_async_engine(url: str):
+        """AsyncEngine for `url` with the app's pool, SQLite profile and metrics"""
+        new_engine = create_async_engine(url, **engine_options(url, is_async=True))
+        if is_sqlite(url) and settings.SQLITE_TUNING_ENABLED:
+            event.listen(new_engine.sync_engine, "connect", apply_sqlite_pragmas)
+        instrument_engine(new_engine.sync_engine)
+        return new_engine
+
+    async_engine = make_async_engine(settings.ASYNC_DATABASE_URL or to_async_url(settings.DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    if settings.READ_DATABASE_URL:
+        async_read_engine = make_async_engine(
+            settings.ASYNC_READ_DATABASE_URL or to_async_url(settings.READ_DATABASE_URL)
+        )
+        AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False,
+                                                   info={"replica": True})
+
+
+@asynccontextmanager
+async def _open_session(async_factory, sync_factory) -> AsyncIterator[AnySession]:
+    """An AsyncSession from `async_factory` in async mode, else a Session from `sync_factory`"""
+    if async_factory is not None:
+        async with async_factory() as db:
+            yield db
+        return
+
+    db = sync_factory()
+    try:
+        yield db
+    finally:
+        await run_in_threadpool(db.close)
+
+
+async def get_session() -> AsyncIterator[AnySession]:
+    """Dependency for async route handlers
+
+    Yields an AsyncSession when DB_ASYNC is enabled and a regular Session
+    otherwise; pass it to `run_db` to execute CRUD code.
+    """
+    async with _open_session(AsyncSessionLocal, SessionLocal) as db:
+        yield db
+
+
+async def get_read_session(x_consistency_token: Optional[str] = ConsistencyToken) -> AsyncIterator[AnySession]:
+    """`get_session` for read-only async routes: the replica unless the client wrote recently"""
+    if use_replica(x_consistency_token):
+        session = _open_session(AsyncReadSessionLocal, ReadSessionLocal)
+    else:
+        session = _open_session(AsyncSessionLocal, SessionLocal)
+    async with session as db:
+        yield db
+
+
+async def run_db(db: AnySession, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run sync CRUD code `fn(session, *args)` without blocking the event loop
+
+    With an AsyncSession the code runs on the event loop through
+    `run_sync`, so no threadpool slot is held while waiting on I/O.
+    With a regular Session it runs in the threadpool as sync handlers do.
+    """
+    if settings.PROFILER_ENABLED:
+        fn = track(fn)
+    if isinstance(db, Session):
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    return await db.run_sync(fn, *args, **kwargs)
+
+
+def pool_status() -> dict:
+    """Connection pool occupancy and checkout wait times"""
+    status = {"sync": engine.pool.status(), "wait": pool_wait_stats.snapshot()}
+    if async_engine is not None:
+        status["async"] = async_engine.pool.status()
+    if read_engine is not None:
+        status["read"] = read_engine.pool.status()
+    if async_read_engine is not None:
+        status["asyncRead"] = async_read_engine.pool.status()
+    return status
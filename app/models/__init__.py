@@ -1,8 +1,14 @@
 from app.models.brand import Brand
 from app.models.balance import Balance
+from app.models.balance_shard import BalanceShard
+from app.models.balance_snapshot import BalanceSnapshot
 from app.models.transaction import Transaction
 from app.models.provision import Provision
 from app.models.customer import Customer
 from app.models.brand_customer import BrandCustomer
+from app.models.idempotency_key import IdempotencyKey
+from app.models.outbox import OutboxEvent, WebhookCursor
+from app.models.job_lease import JobLease
 
-__all__ = ["Brand", "Balance", "Transaction", "Provision", "Customer", "BrandCustomer"]
+__all__ = ["Brand", "Balance", "BalanceShard", "BalanceSnapshot", "Transaction", "Provision", "Customer",
+           "BrandCustomer", "IdempotencyKey", "OutboxEvent", "WebhookCursor", "JobLease"]
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Integer, DateTime, Index
+from datetime import datetime, timezone
+from app.db.base import Base
+
+
+class BalanceShard(Base):
+    """Sub-counter of a hot balance; the real balance is balances.points plus all its shards"""
+    __tablename__ = "balance_shards"
+
+    id = Column(Integer, primary_key=True, index=True)
+    brand_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    shard = Column(Integer, nullable=False)
+    points = Column(Integer, nullable=False, default=0)  # Not yet folded into balances.points
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index('idx_brand_user_shard', 'brand_id', 'user_id', 'shard', unique=True),
+    )
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, String, Integer, DateTime, Index
+from datetime import datetime, timezone
+from app.db.base import Base
+
+
+class BalanceSnapshot(Base):
+    """Ledger total of one balance up to a ledger sequence number
+
+    A balance is the snapshot points plus the ledger entries after
+    `ledger_seq`, minus points locked in active provisions.
+    """
+    __tablename__ = "balance_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    brand_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    ledger_seq = Column(Integer, nullable=False)  # Last ledger entry included
+    points = Column(Integer, nullable=False)  # Sum of ledger points up to ledger_seq
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index('idx_snapshot_brand_user', 'brand_id', 'user_id', unique=True),
+        Index('idx_snapshot_ledger_seq', 'ledger_seq'),
+    )
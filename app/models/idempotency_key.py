@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, Integer, DateTime, Text, Index
+from datetime import datetime, timezone
+from app.db.base import Base
+
+
+class IdempotencyKey(Base):
+    """Stored response of a write request, replayed when the client retries with the same key"""
+    __tablename__ = "idempotency_keys"
+
+    id = Column(String, primary_key=True)  # Composite: brand_id:key
+    brand_id = Column(String, nullable=False)
+    key = Column(String, nullable=False)  # Client's Idempotency-Key header
+    fingerprint = Column(String, nullable=False)  # Hash of route + request body
+    status_code = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)  # JSON response body
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('idx_idempotency_expires_at', 'expires_at'),
+    )
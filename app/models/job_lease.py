@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, DateTime
+from app.db.base import Base
+
+
+class JobLease(Base):
+    """Which worker runs a periodic background job, until the lease expires"""
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)  # Job name
+    owner = Column(String, nullable=False)  # host:pid:random of the holding worker
+    expires_at = Column(DateTime, nullable=False)  # Another worker may take over after this
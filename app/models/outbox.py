@@ -0,0 +1,31 @@
+from sqlalchemy import Column, String, Integer, DateTime, Text, Index
+from datetime import datetime, timezone
+from app.db.base import Base
+
+
+class OutboxEvent(Base):
+    """Balance change event, written in the same transaction as the change it describes"""
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)  # Delivery order, never reused
+    brand_id = Column(String, nullable=False)
+    event_type = Column(String, nullable=False)  # earned, redeemed, provisioned, voided
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index('idx_outbox_brand_id', 'brand_id', 'id'),
+        {"sqlite_autoincrement": True},  # Delivered rows are deleted; their ids must not come back
+    )
+
+
+class WebhookCursor(Base):
+    """Per-brand webhook delivery position and retry state"""
+    __tablename__ = "webhook_cursors"
+
+    brand_id = Column(String, primary_key=True)
+    last_event_id = Column(Integer, nullable=False, default=0)  # Last delivered outbox event
+    attempts = Column(Integer, nullable=False, default=0)  # Consecutive failed deliveries
+    next_attempt_at = Column(DateTime, nullable=True)  # Backoff: no delivery before this time
+    last_error = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy import Column, String, Integer, DateTime, Index
 from datetime import datetime, timezone
 from app.db.base import Base
 
@@ -11,5 +11,11 @@ class Provision(Base):
     user_id = Column(String, nullable=False)
     points = Column(Integer, nullable=False)  # Original provisioned points
     remaining_points = Column(Integer, nullable=False)  # Points still available
+    status = Column(String, nullable=False, default="active")  # active, redeemed, expired
     expires_at = Column(DateTime, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Lets the expired-provision sweeper find its next batch without a full scan
+        Index('idx_provision_status_expires_at', 'status', 'expires_at'),
+    )
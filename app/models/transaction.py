@@ -4,16 +4,26 @@ from app.db.base import Base
 
 
 class Transaction(Base):
+    """Append-only ledger entry; rows are never updated or deleted"""
     __tablename__ = "transactions"
 
-    id = Column(String, primary_key=True)  # Composite: brand_id:txn_id
+    seq = Column(Integer, primary_key=True, autoincrement=True)  # Ledger sequence
+    id = Column(String, nullable=False)  # Composite: brand_id:txn_id
     txn_id = Column(String, nullable=False)  # Brand's transaction ID
     brand_id = Column(String, nullable=False)
     user_id = Column(String, nullable=False)
     points = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False, default="earn")  # earn, redeem, void, import
+    reverses_txn_id = Column(String, nullable=True)  # For voids: the txn_id being reversed
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     __table_args__ = (
         # Ensure transaction ID is unique per brand (not globally)
         Index('idx_brand_txn', 'brand_id', 'txn_id', unique=True),
+        # A brand's ledger in sequence order (exports, ledger tails after snapshots)
+        Index('idx_brand_seq', 'brand_id', 'seq'),
+        # Customer transaction history, keyset-paginated by (created_at, id)
+        Index('idx_brand_user_created', 'brand_id', 'user_id', 'created_at', 'id'),
+        # At most one void per entry, found by the entry it reverses
+        Index('idx_brand_reverses', 'brand_id', 'reverses_txn_id', unique=True),
     )
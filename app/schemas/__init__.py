@@ -1,13 +1,24 @@
 from app.schemas.brand import BrandCreate, BrandResponse
 from app.schemas.balance import BalanceResponse
-from app.schemas.transaction import EarnRequest, RedeemRequest, VoidRequest, TransactionResponse
+from app.schemas.transaction import (
+    EarnRequest,
+    EarnBatchRequest,
+    RedeemRequest,
+    VoidRequest,
+    TransactionResponse,
+    TransactionHistoryItem,
+    TRANSACTION_RESPONSE,
+    TRANSACTION_HISTORY
+)
 from app.schemas.provision import ProvisionRequest, ProvisionResponse
 from app.schemas.customer import (
     CustomerCreate,
     CustomerResponse,
     BrandCustomerCreate,
     BrandCustomerResponse,
-    BrandCustomerDetail
+    BrandCustomerDetail,
+    BRAND_CUSTOMER_DETAIL,
+    BRAND_CUSTOMER_DETAILS
 )
 
 __all__ = [
@@ -15,9 +26,13 @@ __all__ = [
     "BrandResponse",
     "BalanceResponse",
     "EarnRequest",
+    "EarnBatchRequest",
     "RedeemRequest",
     "VoidRequest",
     "TransactionResponse",
+    "TransactionHistoryItem",
+    "TRANSACTION_RESPONSE",
+    "TRANSACTION_HISTORY",
     "ProvisionRequest",
     "ProvisionResponse",
     "CustomerCreate",
@@ -25,4 +40,6 @@ __all__ = [
     "BrandCustomerCreate",
     "BrandCustomerResponse",
     "BrandCustomerDetail",
+    "BRAND_CUSTOMER_DETAIL",
+    "BRAND_CUSTOMER_DETAILS",
 ]
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from typing import List
 import re
 
 
@@ -49,3 +50,8 @@ class BrandCustomerDetail(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Precompiled for fast_response, which checks them only with RESPONSE_VALIDATION on
+BRAND_CUSTOMER_DETAIL = TypeAdapter(BrandCustomerDetail)
+BRAND_CUSTOMER_DETAILS = TypeAdapter(List[BrandCustomerDetail])
@@ -1,4 +1,15 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from typing import List, Optional
+
+# Transaction IDs the API assigns to its own ledger entries (voids, imported initial points);
+# clients cannot use them
+RESERVED_TXN_ID_PREFIXES = ("void:", "import:")
+
+
+def check_txn_id(v: str) -> str:
+    if v.startswith(RESERVED_TXN_ID_PREFIXES):
+        raise ValueError(f"txnId must not start with {' or '.join(RESERVED_TXN_ID_PREFIXES)}")
+    return v
 
 
 class EarnRequest(BaseModel):
@@ -6,6 +17,15 @@ class EarnRequest(BaseModel):
     points: int = Field(..., gt=0)
     txnId: str
 
+    @field_validator('txnId')
+    @classmethod
+    def validate_txn_id(cls, v: str) -> str:
+        return check_txn_id(v)
+
+
+class EarnBatchRequest(BaseModel):
+    items: List[EarnRequest] = Field(..., min_length=1, max_length=10000)
+
 
 class RedeemRequest(BaseModel):
     customerId: str = Field(..., description="Brand's custom customer ID")
@@ -13,6 +33,11 @@ class RedeemRequest(BaseModel):
     txnId: str
     provisionId: str
 
+    @field_validator('txnId')
+    @classmethod
+    def validate_txn_id(cls, v: str) -> str:
+        return check_txn_id(v)
+
 
 class VoidRequest(BaseModel):
     txnId: str
@@ -29,3 +54,16 @@ class TransactionResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class TransactionHistoryItem(BaseModel):
+    txnId: str
+    kind: str  # earn, redeem, void, import
+    points: int
+    reversesTxnId: Optional[str] = None
+    createdAt: str
+
+
+# Precompiled for fast_response, which checks them only with RESPONSE_VALIDATION on
+TRANSACTION_RESPONSE = TypeAdapter(TransactionResponse)
+TRANSACTION_HISTORY = TypeAdapter(List[TransactionHistoryItem])
@@ -0,0 +1,351 @@
+"""
+Loyalty API Benchmark
+
+Drives the real FastAPI app through the main loyalty flows and reports
+throughput, p50/p95/p99 latency and SQL queries per request as JSON.
+
+    python benchmarks/loyalty_bench.py                       # in-process (ASGI transport)
+    python benchmarks/loyalty_bench.py --server --workers 4  # uvicorn with 4 workers
+    python benchmarks/loyalty_bench.py -o after.json --compare before.json
+
+Every run uses a fresh temporary SQLite database unless DATABASE_URL is
+set. Requires httpx (and uvicorn for --server).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BRAND = "brand-001"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float]) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "max": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+class QueryCounter:
+    """Counts SQL statements on the app's engines (in-process runs only)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self) -> None:
+        from sqlalchemy import event
+        from app.db.group_commit import group_writer
+        from app.db.session import engine, async_engine
+
+        engines = [engine] + ([async_engine.sync_engine] if async_engine is not None else [])
+        if group_writer is not None and group_writer.engine not in engines:
+            engines.append(group_writer.engine)  # Writes run on its own connection with group commit
+        for target in engines:
+            event.listen(target, "before_cursor_execute", self._count)
+
+    def _count(self, *args) -> None:
+        self.count += 1
+
+
+class Recorder:
+    """Latencies per operation and overall for one scenario"""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def call(self, op: str, method: str, url: str, expect: int = 200, **kwargs) -> Optional[dict]:
+        start = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.latencies.setdefault(op, []).append(time.perf_counter() - start)
+        if response.status_code != expect:
+            self.errors[f"{op} {response.status_code}"] = self.errors.get(f"{op} {response.status_code}", 0) + 1
+            return None
+        return response.json()
+
+    def report(self, seconds: float, queries: Optional[int]) -> dict:
+        everything = [value for values in self.latencies.values() for value in values]
+        return {
+            "requests": len(everything),
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "throughput": round(len(everything) / seconds, 1) if seconds else 0.0,
+            "latencyMs": summarize(everything),
+            "queriesPerRequest": round(queries / len(everything), 2) if queries is not None and everything else None,
+            "byOperation": {op: summarize(values) for op, values in sorted(self.latencies.items())},
+        }
+
+
+class Ids:
+    """Unique customer, transaction and provision IDs for one run"""
+
+    def __init__(self):
+        self.run = uuid.uuid4().hex[:8]
+        self.phone_base = random.randrange(0, 10 ** 8) * 10
+        self.counter = 0
+
+    def next(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    def phone(self, n: int) -> str:
+        return f"5{(self.phone_base + n) % 10 ** 9:09d}"
+
+    def key(self, prefix: str, n: int) -> str:
+        return f"{prefix}-{self.run}-{n}"
+
+
+async def run_concurrently(total: int, concurrency: int, task: Callable[[int], Awaitable[None]]) -> None:
+    """Run task(0..total-1) with at most `concurrency` in flight"""
+    queue = iter(range(total))
+
+    async def worker():
+        for i in queue:
+            await task(i)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def register(rec: Recorder, ids: Ids, points: int = 0) -> str:
+    n = ids.next()
+    customer_id = ids.key("C", n)
+    await rec.call("register", "POST", f"/brands/{BRAND}/customers", expect=201,
+                   json={"phoneNumber": ids.phone(n), "brandCustomerId": customer_id})
+    if points:
+        await rec.call("earn", "POST", f"/brands/{BRAND}/earn",
+                       json={"customerId": customer_id, "points": points, "txnId": ids.key("T", ids.next())})
+    return customer_id
+
+
+async def scenario_flow(rec: Recorder, ids: Ids, args) -> None:
+    """register -> earn -> provision -> partial redeem -> void, per customer"""
+    expires_at = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+
+    async def flow(_):
+        customer_id = await register(rec, ids)
+        earn_txn = ids.key("T", ids.next())
+        provision_id = ids.key("P", ids.next())
+        await rec.call("earn", "POST", f"/brands/{BRAND}/earn",
+                       json={"customerId": customer_id, "points": 100, "txnId": earn_txn})
+        await rec.call("provision", "POST", f"/brands/{BRAND}/provision",
+                       json={"customerId": customer_id, "points": 60, "provisionId": provision_id,
+                             "expiresAt": expires_at})
+        await rec.call("redeem", "POST", f"/brands/{BRAND}/redeem",
+                       json={"customerId": customer_id, "points": 20, "txnId": ids.key("R", ids.next()),
+                             "provisionId": provision_id})
+        await rec.call("void", "POST", f"/brands/{BRAND}/void", json={"txnId": earn_txn})
+
+    await run_concurrently(args.flows, args.concurrency, flow)
+
+
+async def scenario_mixed(rec: Recorder, ids: Ids, args, customers: List[str]) -> None:
+    """Random reads (balance, customer, history) and earns at --read-ratio"""
+    async def op(_):
+        customer_id = random.choice(customers)
+        roll = random.random()
+        if roll >= args.read_ratio:
+            await rec.call("earn", "POST", f"/brands/{BRAND}/earn",
+                           json={"customerId": customer_id, "points": 5, "txnId": ids.key("T", ids.next())})
+        elif roll < args.read_ratio / 3:
+            await rec.call("balance", "GET", f"/brands/{BRAND}/customers/{customer_id}/balance")
+        elif roll < args.read_ratio * 2 / 3:
+            await rec.call("customer", "GET", f"/brands/{BRAND}/customers/{customer_id}")
+        else:
+            await rec.call("history", "GET", f"/brands/{BRAND}/customers/{customer_id}/transactions",
+                           params={"limit": 20})
+
+    await run_concurrently(args.requests, args.concurrency, op)
+
+
+async def scenario_hot(rec: Recorder, ids: Ids, args, customer_id: str) -> None:
+    """Every request earns on the same customer"""
+    async def op(_):
+        await rec.call("earn", "POST", f"/brands/{BRAND}/earn",
+                       json={"customerId": customer_id, "points": 1, "txnId": ids.key("T", ids.next())})
+
+    await run_concurrently(args.requests, args.concurrency, op)
+
+
+async def run_scenarios(client: httpx.AsyncClient, args, counter: Optional[QueryCounter]) -> dict:
+    ids = Ids()
+    results = {}
+
+    async def measure(name: str, body: Callable[[Recorder], Awaitable[None]]) -> None:
+        rec = Recorder(client)
+        before = counter.count if counter else None
+        start = time.perf_counter()
+        await body(rec)
+        seconds = time.perf_counter() - start
+        results[name] = rec.report(seconds, counter.count - before if counter else None)
+        print(f"{name:>8}: {results[name]['throughput']:>8} req/s  "
+              f"p50 {results[name]['latencyMs']['p50']} ms  p99 {results[name]['latencyMs']['p99']} ms",
+              file=sys.stderr)
+
+    # Setup (not measured): customers with points for the read/write mix and the hot customer
+    setup = Recorder(client)
+    customers = [await register(setup, ids, points=1000) for _ in range(args.customers)]
+    hot_customer = await register(setup, ids, points=1000)
+    if setup.errors:
+        raise RuntimeError(f"Benchmark setup failed: {setup.errors}")
+
+    if "flow" in args.scenarios:
+        await measure("flow", lambda rec: scenario_flow(rec, ids, args))
+    if "mixed" in args.scenarios:
+        await measure("mixed", lambda rec: scenario_mixed(rec, ids, args, customers))
+    if "hot" in args.scenarios:
+        await measure("hot", lambda rec: scenario_hot(rec, ids, args, hot_customer))
+    return results
+
+
+async def run_in_process(args) -> dict:
+    from main import app
+
+    counter = QueryCounter()
+    counter.install()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_scenarios(client, args, counter)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_server(args) -> dict:
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=os.environ.copy()
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            for _ in range(100):
+                if server.poll() is not None:
+                    raise RuntimeError(f"Server exited with code {server.returncode} (is uvicorn installed?)")
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("Server did not start")
+            # Queries happen in the worker processes, so they are not counted here
+            return await run_scenarios(client, args, None)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Print throughput and p95/p99 changes against a previous report"""
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for label, now, then in (
+            ("throughput", result["throughput"], before["throughput"]),
+            ("p95", result["latencyMs"]["p95"], before["latencyMs"]["p95"]),
+            ("p99", result["latencyMs"]["p99"], before["latencyMs"]["p99"]),
+        ):
+            pct = (now - then) / then * 100 if then else 0.0
+            changes.append(f"{label} {then} -> {now} ({pct:+.1f}%)")
+        print(f"{name:>8}: " + ", ".join(changes), file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the loyalty API flows")
+    parser.add_argument("--server", action="store_true", help="Run against uvicorn instead of in-process")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers with --server")
+    parser.add_argument("--scenarios", nargs="+", choices=["flow", "mixed", "hot"], default=["flow", "mixed", "hot"])
+    parser.add_argument("--flows", type=int, default=200, help="Customers taken through the full flow")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests for the mixed and hot scenarios")
+    parser.add_argument("--customers", type=int, default=200, help="Customers for the mixed scenario")
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="Share of reads in the mixed scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    if "DATABASE_URL" not in os.environ:
+        fd, path = tempfile.mkstemp(prefix="loyalty-bench-", suffix=".db")
+        os.close(fd)
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    # Keep periodic background jobs out of the measurements
+    os.environ.setdefault("PROVISION_SWEEP_ENABLED", "False")
+    os.environ.setdefault("BALANCE_SNAPSHOT_ENABLED", "False")
+
+    scenarios = asyncio.run(run_server(args) if args.server else run_in_process(args))
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "mode": f"server ({args.workers} workers)" if args.server else "in-process",
+            "python": platform.python_version(),
+            "concurrency": args.concurrency,
+            "flows": args.flows,
+            "requests": args.requests,
+            "readRatio": args.read_ratio,
+            "env": {key: os.environ[key] for key in ("DB_ASYNC", "GROUP_COMMIT_ENABLED") if key in os.environ},
+        },
+        "scenarios": scenarios,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
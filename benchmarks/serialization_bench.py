@@ -0,0 +1,166 @@
+"""
+Response Serialization Benchmark
+
+Measures the CPU time per request of FastAPI's default response path
+(`jsonable_encoder` for plain dicts, `response_model` validation for
+list routes, stdlib JSON) against `fast_response`, using the app's own
+payload shapes and schemas. Requests go through the full ASGI stack of a
+small app without a database, so the difference is the serialization
+saving alone.
+
+    python benchmarks/serialization_bench.py
+    python benchmarks/serialization_bench.py --requests 5000 -o serialization.json
+
+Requires httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.core.responses import fast_response, orjson  # noqa: E402
+from app.schemas import (BrandCustomerDetail, TransactionHistoryItem, BRAND_CUSTOMER_DETAILS,  # noqa: E402
+                         TRANSACTION_HISTORY, TRANSACTION_RESPONSE)
+
+
+def earn_payload() -> dict:
+    return {
+        "status": "earned",
+        "txnId": "TXN-000123",
+        "brandId": "brand-001",
+        "customerId": "CUST-0042",
+        "phoneNumber": "5551234567",
+        "points": 1250,
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def history_payload(size: int) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "txnId": f"TXN-{i:06d}",
+            "kind": "void" if i % 10 == 0 else "earn",
+            "points": -50 if i % 10 == 0 else 50,
+            "reversesTxnId": f"TXN-{i + 1:06d}" if i % 10 == 0 else None,
+            "createdAt": (now - timedelta(minutes=i)).isoformat(),
+        }
+        for i in range(size)
+    ]
+
+
+def customers_payload(size: int) -> List[dict]:
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {"phoneNumber": f"555{i:07d}", "brandCustomerId": f"CUST-{i:06d}", "points": i * 10, "createdAt": now}
+        for i in range(size)
+    ]
+
+
+def build_app(page_size: int, list_size: int) -> FastAPI:
+    """One default and one fast route per payload shape"""
+    earn, history, customers = earn_payload(), history_payload(page_size), customers_payload(list_size)
+    app = FastAPI()
+
+    @app.get("/default/earn", response_class=JSONResponse)
+    async def default_earn():
+        return earn
+
+    @app.get("/fast/earn")
+    async def fast_earn():
+        return fast_response(earn, TRANSACTION_RESPONSE)
+
+    @app.get("/default/history", response_model=List[TransactionHistoryItem], response_class=JSONResponse)
+    async def default_history():
+        return history
+
+    @app.get("/fast/history")
+    async def fast_history():
+        return fast_response(history, TRANSACTION_HISTORY)
+
+    @app.get("/default/customers", response_model=List[BrandCustomerDetail], response_class=JSONResponse)
+    async def default_customers():
+        return customers
+
+    @app.get("/fast/customers")
+    async def fast_customers():
+        return fast_response(customers, BRAND_CUSTOMER_DETAILS)
+
+    return app
+
+
+async def cpu_per_request(client: httpx.AsyncClient, path: str, requests: int) -> float:
+    """Process CPU microseconds per request, after a short warm-up"""
+    for _ in range(min(50, requests)):
+        (await client.get(path)).raise_for_status()
+    start = time.process_time()
+    for _ in range(requests):
+        (await client.get(path)).raise_for_status()
+    return (time.process_time() - start) / requests * 1e6
+
+
+async def run(args) -> Dict[str, dict]:
+    app = build_app(args.page_size, args.list_size)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, requests in (("earn", args.requests), ("history", args.requests),
+                               ("customers", max(1, args.requests // 10))):
+            default = await cpu_per_request(client, f"/default/{name}", requests)
+            fast = await cpu_per_request(client, f"/fast/{name}", requests)
+            results[name] = {
+                "requests": requests,
+                "defaultCpuUs": round(default, 1),
+                "fastCpuUs": round(fast, 1),
+                "savedCpuUs": round(default - fast, 1),
+                "savedPct": round((default - fast) / default * 100, 1) if default else 0.0,
+            }
+            print(f"{name:>10}: {default:9.1f} us -> {fast:9.1f} us per request "
+                  f"({results[name]['savedPct']:.1f}% less CPU)", file=sys.stderr)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark response serialization CPU cost")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per route (a tenth for customers)")
+    parser.add_argument("--page-size", type=int, default=100, help="Items in the transaction history page")
+    parser.add_argument("--list-size", type=int, default=1000, help="Items in the customer list")
+    parser.add_argument("-o", "--output", help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    routes = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "encoder": "orjson" if orjson is not None else "json",
+            "pageSize": args.page_size,
+            "listSize": args.list_size,
+        },
+        "routes": routes,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,11 +24,13 @@ if [ -d "$APP_DIR" ]; then
     echo "3. Updating existing repository..."
     cd "$APP_DIR"
     git pull
+    FRESH_INSTALL=false
 else
     echo "3. Cloning repository..."
     cd /home/ubuntu
     git clone "$REPO_URL"
     cd "$APP_DIR"
+    FRESH_INSTALL=true
 fi
 
 # Create virtual environment
@@ -41,9 +43,15 @@ echo "5. Installing Python packages..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
-# Initialize database
-echo "6. Initializing database with seed data..."
-python seed_data.py
+# Initialize the database, or upgrade the existing one in place (seed_data.py drops every table)
+if [ "$FRESH_INSTALL" = true ]; then
+    echo "6. Initializing database with seed data..."
+    python seed_data.py
+else
+    echo "6. Upgrading database schema..."
+    sudo systemctl stop loyalty-api || true  # Old workers must not write during the upgrade
+    python manage.py migrate
+fi
 
 # Create systemd service
 echo "7. Creating systemd service..."
@@ -57,6 +65,7 @@ Type=simple
 User=ubuntu
 WorkingDirectory=$APP_DIR
 Environment="PATH=$APP_DIR/venv/bin"
+Environment="STARTUP_MODE=production"
 ExecStart=$APP_DIR/venv/bin/python main.py
 Restart=always
 RestartSec=10
@@ -1,39 +1,103 @@
+import time
+_import_start = time.perf_counter()  # Taken first, so the startup timings include module imports
+
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
-from app.db.base import Base
-from app.db.session import engine, SessionLocal
-from app.db.init_db import init_db
+from app.db.session import async_engine, async_read_engine, pool_status
+from app.db.group_commit import group_writer
+from app.core.cache import brand_registry, customer_identity_cache
+from app.core.background import run_periodically, sweep_expired_provisions, snapshot_balances, job_stats
+from app.core.webhooks import webhook_dispatcher
+from app.core.crud import BalanceCRUD, IdempotencyCRUD
+from app.core.consistency import ConsistencyTokenMiddleware
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.core.responses import FastJSONResponse
+from app.core.profiler import ProfilerMiddleware, sampler
+from app.core.startup import check_schema, create_schema, preload, seed, startup_timer
 from app.api import api_router
 
+startup_timer.record("imports", time.perf_counter() - _import_start)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database on startup"""
-    # Create tables
-    Base.metadata.create_all(bind=engine)
+    """Prepare the database and caches and start background work, timing each phase"""
+    if settings.STARTUP_MODE == "development":
+        # Create tables and seed sample brands (production runs `manage.py init` once instead)
+        with startup_timer.phase("schema"):
+            create_schema()
+        with startup_timer.phase("seed"):
+            seed()
+    else:
+        with startup_timer.phase("schemaCheck"):
+            check_schema()
+
+    # Warm the brand cache and connection pools concurrently
+    with startup_timer.phase("preload"):
+        await preload(startup_timer)
+
+    with startup_timer.phase("background"):
+        if group_writer is not None:
+            group_writer.start()
 
-    # Initialize with sample data
-    db = SessionLocal()
-    try:
-        init_db(db)
-    finally:
-        db.close()
+        # Background jobs
+        tasks = []
+        # Always scheduled: accounts dropped from SHARDED_BALANCES still have shard rows to fold
+        tasks.append(asyncio.create_task(run_periodically(
+            "fold balance shards", settings.BALANCE_SHARD_FOLD_INTERVAL_SECONDS, BalanceCRUD.fold_shards
+        )))
+        if settings.PROVISION_SWEEP_ENABLED:
+            tasks.append(asyncio.create_task(run_periodically(
+                "sweep expired provisions", settings.PROVISION_SWEEP_INTERVAL_SECONDS, sweep_expired_provisions
+            )))
+        if settings.BALANCE_SNAPSHOT_ENABLED:
+            tasks.append(asyncio.create_task(run_periodically(
+                "snapshot balances", settings.BALANCE_SNAPSHOT_INTERVAL_SECONDS, snapshot_balances
+            )))
+        tasks.append(asyncio.create_task(run_periodically(
+            "purge idempotency keys", settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS, IdempotencyCRUD.delete_expired
+        )))
+        if webhook_dispatcher is not None:
+            await webhook_dispatcher.start()
+            tasks.append(asyncio.create_task(webhook_dispatcher.run(settings.WEBHOOK_DISPATCH_INTERVAL_SECONDS)))
+    startup_timer.log()
 
     yield
 
+    for task in tasks:
+        task.cancel()
+    if webhook_dispatcher is not None:
+        await webhook_dispatcher.stop()
+    if group_writer is not None:
+        group_writer.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    if async_read_engine is not None:
+        await async_read_engine.dispose()
+
 
 # Create FastAPI application
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
 # Include all API routes
 app.include_router(api_router)
 
+if settings.METRICS_ENABLED or settings.QUERY_DEBUG:
+    app.add_middleware(MetricsMiddleware)
+if settings.PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+if settings.READ_DATABASE_URL:
+    app.add_middleware(ConsistencyTokenMiddleware)
+
 
 @app.get("/")
 def root():
@@ -41,10 +105,25 @@ def root():
     return {
         "app": settings.APP_NAME,
         "version": settings.APP_VERSION,
-        "status": "running"
+        "status": "running",
+        "brandCache": brand_registry.stats(),
+        "customerCache": customer_identity_cache.stats(),
+        "dbPool": pool_status(),
+        "backgroundJobs": job_stats,
+        "groupCommit": group_writer.stats() if group_writer is not None else None,
+        "webhooks": webhook_dispatcher.stats() if webhook_dispatcher is not None else None,
+        "profiler": sampler.stats() if settings.PROFILER_ENABLED else None,
+        "startup": startup_timer.stats()
     }
 
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics():
+        """Prometheus metrics: per-route latency and status codes, SQL statements, time and commits"""
+        return PlainTextResponse(render_metrics(startup_timer.render()), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=settings.STARTUP_MODE == "development")
@@ -0,0 +1,186 @@
+"""
+Management Commands
+
+    python manage.py init
+    python manage.py migrate [--check]
+    python manage.py snapshot-balances
+    python manage.py rebuild-balances [--brand BRAND_ID] [--dry-run]
+    python manage.py export BRAND_ID {transactions,balances} [--format csv] [--since ...] [--until ...]
+                            [--cursor CURSOR] [--gzip] [-o FILE]
+    python manage.py import-customers BRAND_ID FILE [--format ndjson] [--rejects FILE]
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.core.config import settings
+from app.core.crud import BrandCRUD, LedgerCRUD, unit_of_work
+from app.core.customer_import import import_customers as bulk_import_customers, parse_rows
+from app.core.export import export_stream
+from app.core.startup import create_schema, seed
+from app.db.migrate import pending_upgrades
+from app.db.session import SessionLocal, engine
+from app.models import Brand
+
+
+def init(args) -> None:
+    """Create missing tables and seed the sample brands; run once per deployment, before the workers"""
+    for upgrade in create_schema():
+        print(f"✓ Upgraded {upgrade}")
+    seed()
+    print("✓ Database initialized")
+
+
+def migrate(args) -> None:
+    """Create missing tables and upgrade existing ones; stop the workers first"""
+    if args.check:
+        with engine.connect() as conn:
+            pending = pending_upgrades(conn)
+        for upgrade in pending:
+            print(f"  pending: {upgrade}")
+        sys.exit(1 if pending else 0)
+    upgrades = create_schema()
+    for upgrade in upgrades:
+        print(f"✓ Upgraded {upgrade}")
+    print("✓ Database schema is up to date" if upgrades else "✓ Nothing to upgrade")
+
+
+def snapshot_balances(args) -> None:
+    """Fold committed ledger entries older than BALANCE_SNAPSHOT_LAG_SECONDS into balance snapshots"""
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            try:
+                with unit_of_work(db):
+                    written = LedgerCRUD.take_snapshots(
+                        db, settings.BALANCE_SNAPSHOT_BATCH_SIZE, settings.BALANCE_SNAPSHOT_LAG_SECONDS
+                    )
+            except StaleDataError:
+                continue  # The background job folded this batch first; re-read the watermark
+            if written == 0:
+                break
+            total += written
+        print(f"✓ Wrote {total} balance snapshots")
+    finally:
+        db.close()
+
+
+def rebuild_balances(args) -> None:
+    """Recompute balances from snapshots and ledger tails, one transaction per brand"""
+    db = SessionLocal()
+    try:
+        brand_ids = [args.brand] if args.brand else [row.id for row in db.query(Brand.id)]
+        for brand_id in brand_ids:
+            with unit_of_work(db):
+                result = LedgerCRUD.rebuild_balances(db, brand_id, dry_run=args.dry_run)
+            action = "would correct" if args.dry_run else "corrected"
+            print(f"{brand_id}: {result['balances']} balances, {action} {result['corrected']}")
+    finally:
+        db.close()
+
+
+def _parse_utc(value):
+    """Parse an ISO 8601 time; naive times are taken as UTC"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def export(args) -> None:
+    """Stream a brand's transactions or balances to a file or stdout
+
+    With --cursor the output file is appended to, so an interrupted
+    export can be continued from the last record written.
+    """
+    chunks = export_stream(
+        args.dataset, args.brand_id, args.format, args.cursor,
+        _parse_utc(args.since), _parse_utc(args.until), args.gzip
+    )
+    if args.output == "-":
+        out = sys.stdout.buffer
+    else:
+        out = open(args.output, "ab" if args.cursor else "wb")
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+        out.flush()
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+def import_customers(args) -> None:
+    """Bulk-register customers from a CSV or NDJSON file, reading it line by line"""
+    db = SessionLocal()
+    try:
+        if BrandCRUD.get_by_id(db, args.brand_id) is None:
+            sys.exit(f"Brand '{args.brand_id}' not found")
+        with open(args.file, encoding="utf-8-sig", newline="") as source:
+            result = bulk_import_customers(db, args.brand_id, parse_rows(source, args.format))
+    finally:
+        db.close()
+
+    print(f"✓ Imported {result['imported']} customers, rejected {result['rejected']}")
+    if args.rejects:
+        with open(args.rejects, "w", encoding="utf-8") as out:
+            for reject in result["rejects"]:
+                out.write(json.dumps(reject, ensure_ascii=False) + "\n")
+    else:
+        for reject in result["rejects"]:
+            print(f"  line {reject['line']}: {reject['reason']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=f"{settings.APP_NAME} management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    setup = commands.add_parser("init", help="Create tables and seed sample brands (STARTUP_MODE=production skips this)")
+    setup.set_defaults(func=init)
+
+    upgrade = commands.add_parser("migrate", help="Create missing tables and upgrade existing ones (stop the workers first)")
+    upgrade.add_argument("--check", action="store_true", help="Only list pending upgrades; exit 1 if there are any")
+    upgrade.set_defaults(func=migrate)
+
+    snapshot = commands.add_parser("snapshot-balances", help="Bring balance snapshots up to date")
+    snapshot.set_defaults(func=snapshot_balances)
+
+    rebuild = commands.add_parser(
+        "rebuild-balances",
+        help="Recompute balances from the ledger (stop write traffic first)"
+    )
+    rebuild.add_argument("--brand", help="Only rebuild this brand")
+    rebuild.add_argument("--dry-run", action="store_true", help="Report wrong balances without fixing them")
+    rebuild.set_defaults(func=rebuild_balances)
+
+    dump = commands.add_parser("export", help="Stream a brand's transactions or balances as CSV or NDJSON")
+    dump.add_argument("brand_id")
+    dump.add_argument("dataset", choices=["transactions", "balances"])
+    dump.add_argument("--format", choices=["csv", "ndjson"], default="ndjson")
+    dump.add_argument("--since", help="Transactions at or after this ISO 8601 time")
+    dump.add_argument("--until", help="Transactions before this ISO 8601 time")
+    dump.add_argument("--cursor", help="Resume after this seq (transactions) or customerId (balances)")
+    dump.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+    dump.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    dump.set_defaults(func=export)
+
+    load = commands.add_parser("import-customers", help="Bulk-register customers from a CSV or NDJSON file")
+    load.add_argument("brand_id")
+    load.add_argument("file")
+    load.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    load.add_argument("--rejects", help="Write rejected records to this NDJSON file instead of printing them")
+    load.set_defaults(func=import_customers)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""Point the app at a throwaway SQLite database before anything imports it"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DB_DIR = tempfile.mkdtemp(prefix="loyalty-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'loyalty.db')}"
+os.environ["QUERY_DEBUG"] = "True"  # Counts statements per request so query budgets are enforced
+
+import pytest  # noqa: E402
+
+from app.core.crud import unit_of_work  # noqa: E402
+from app.core.startup import create_schema  # noqa: E402
+from app.db.session import SessionLocal  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    create_schema()
+
+
+def in_transaction(fn, *args):
+    """Run a CRUD call in its own session and transaction, like a request or background job"""
+    db = SessionLocal()
+    try:
+        with unit_of_work(db):
+            return fn(db, *args)
+    finally:
+        db.close()
@@ -0,0 +1,99 @@
+import threading
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.core.crud import BalanceCRUD, JobLeaseCRUD, LedgerCRUD, ProvisionCRUD, TransactionCRUD
+from app.db.session import SessionLocal
+from app.models import BalanceSnapshot, Transaction
+
+from conftest import in_transaction
+
+BRAND_ID = "brand-sweep"
+
+
+def run_concurrently(target, threads: int) -> list:
+    errors = []
+
+    def run():
+        try:
+            target()
+        except Exception as exc:
+            errors.append(exc)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return errors
+
+
+def test_concurrent_sweeps_refund_each_provision_once():
+    expired_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+
+    def setup(db):
+        BalanceCRUD.get_or_create(db, BRAND_ID, "sweep-customer")
+        for i in range(40):
+            ProvisionCRUD.create(db, f"sweep-{i}", BRAND_ID, "sweep-customer", 10, expired_at)
+
+    in_transaction(setup)
+
+    def sweep():
+        while in_transaction(ProvisionCRUD.reclaim_expired, 7)["provisions"]:
+            pass
+
+    assert not run_concurrently(sweep, 4)
+    db = SessionLocal()
+    try:
+        assert BalanceCRUD.get_points(db, BRAND_ID, "sweep-customer").points == 400
+    finally:
+        db.close()
+
+
+def test_job_lease_has_one_holder_until_it_expires():
+    winners = []
+
+    def acquire(owner):
+        if in_transaction(JobLeaseCRUD.acquire, "test job", owner, 60):
+            winners.append(owner)
+
+    assert not run_concurrently(lambda: acquire(threading.current_thread().name), 4)
+    assert len(winners) == 1
+    assert in_transaction(JobLeaseCRUD.acquire, "test job", winners[0], 60)  # Renewal
+    assert not in_transaction(JobLeaseCRUD.acquire, "test job", "other worker", 60)
+
+    in_transaction(JobLeaseCRUD.acquire, "expiring job", "stopped worker", -1)
+    assert in_transaction(JobLeaseCRUD.acquire, "expiring job", "other worker", 60)
+
+
+def test_concurrent_snapshot_runs_fold_each_entry_once():
+    def setup(db):
+        TransactionCRUD.bulk_create(db, "brand-ledger", [
+            {"txn_id": f"ledger-{i}", "user_id": f"user-{i % 5}", "points": i} for i in range(200)
+        ])
+
+    in_transaction(setup)
+
+    def snapshot():
+        while True:
+            try:
+                if not in_transaction(LedgerCRUD.take_snapshots, 7, 0):
+                    return
+            except StaleDataError:
+                pass
+
+    assert not run_concurrently(snapshot, 4)
+    db = SessionLocal()
+    try:
+        ledger = dict(db.execute(
+            select(Transaction.user_id, func.sum(Transaction.points))
+            .where(Transaction.brand_id == "brand-ledger").group_by(Transaction.user_id)
+        ).all())
+        snapshots = dict(db.execute(
+            select(BalanceSnapshot.user_id, BalanceSnapshot.points).where(BalanceSnapshot.brand_id == "brand-ledger")
+        ).all())
+        assert snapshots == ledger
+    finally:
+        db.close()
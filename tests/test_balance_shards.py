@@ -0,0 +1,80 @@
+import os
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.core import crud
+from app.core.crud import BalanceCRUD
+from app.db.session import SessionLocal
+
+from conftest import DB_DIR, in_transaction
+
+BRAND_ID = "brand-shards"
+USER_ID = "hot-customer"
+
+
+def test_fold_loses_no_points_under_concurrent_earns_and_folds(monkeypatch):
+    monkeypatch.setattr(crud, "SHARDED_BALANCES", frozenset({(BRAND_ID, USER_ID)}))
+    earners, earns_each, folders = 4, 50, 2
+    done = threading.Event()
+    errors = []
+
+    def earn():
+        try:
+            for _ in range(earns_each):
+                in_transaction(BalanceCRUD.increment, BRAND_ID, USER_ID, 1)
+        except Exception as exc:
+            errors.append(exc)
+
+    def fold():
+        try:
+            while not done.is_set():
+                in_transaction(BalanceCRUD.fold_shards)
+        except Exception as exc:
+            errors.append(exc)
+
+    fold_threads = [threading.Thread(target=fold) for _ in range(folders)]
+    earn_threads = [threading.Thread(target=earn) for _ in range(earners)]
+    for thread in fold_threads + earn_threads:
+        thread.start()
+    for thread in earn_threads:
+        thread.join()
+    done.set()
+    for thread in fold_threads:
+        thread.join()
+    assert not errors
+
+    expected = earners * earns_each
+    db = SessionLocal()
+    try:
+        assert BalanceCRUD.get_points(db, BRAND_ID, USER_ID).points == expected
+        db.rollback()
+        in_transaction(BalanceCRUD.fold_shards)
+        assert BalanceCRUD.get_points(db, BRAND_ID, USER_ID).points == expected
+    finally:
+        db.close()
+
+
+def test_shards_of_an_account_dropped_from_the_config_still_count(monkeypatch):
+    user_id = "formerly-hot"
+    monkeypatch.setattr(crud, "SHARDED_BALANCES", frozenset({(BRAND_ID, user_id)}))
+    in_transaction(BalanceCRUD.increment, BRAND_ID, user_id, 50)
+    monkeypatch.setattr(crud, "SHARDED_BALANCES", frozenset())  # Restarted without it
+
+    assert in_transaction(BalanceCRUD.get_points, BRAND_ID, user_id).points == 50
+    assert in_transaction(lambda db: dict(
+        (row.user_id, row.points) for row in BalanceCRUD.stream_for_brand(db, BRAND_ID)
+    ))[user_id] == 50
+    assert in_transaction(BalanceCRUD.deduct_points, BRAND_ID, user_id, 30).points == 20
+    assert in_transaction(BalanceCRUD.get_points, BRAND_ID, user_id).points == 20
+
+
+def test_balance_reads_work_on_a_read_only_replica():
+    replica = create_engine(f"sqlite:///file:{os.path.join(DB_DIR, 'loyalty.db')}?mode=ro&uri=true")
+    db = Session(replica)
+    try:
+        assert BalanceCRUD.get_points(db, BRAND_ID, "never-credited").points == 0
+    finally:
+        db.close()
+        replica.dispose()
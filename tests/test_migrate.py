@@ -0,0 +1,68 @@
+import os
+
+from sqlalchemy import inspect, text
+
+from app.db.migrate import pending_upgrades, upgrade_schema
+from app.db.session import make_engine
+
+from conftest import DB_DIR
+
+# The two tables as the first release created them
+BASELINE_DDL = [
+    """CREATE TABLE transactions (
+        id VARCHAR NOT NULL, txn_id VARCHAR NOT NULL, brand_id VARCHAR NOT NULL, user_id VARCHAR NOT NULL,
+        points INTEGER NOT NULL, created_at DATETIME, PRIMARY KEY (id))""",
+    "CREATE UNIQUE INDEX idx_brand_txn ON transactions (brand_id, txn_id)",
+    """CREATE TABLE provisions (
+        provision_id VARCHAR NOT NULL, brand_id VARCHAR NOT NULL, user_id VARCHAR NOT NULL,
+        points INTEGER NOT NULL, remaining_points INTEGER NOT NULL, expires_at DATETIME NOT NULL,
+        created_at DATETIME, PRIMARY KEY (provision_id))""",
+    "INSERT INTO transactions VALUES ('b1:r1', 'r1', 'b1', 'c1', -20, '2025-01-01 10:00:02')",
+    "INSERT INTO transactions VALUES ('b1:e1', 'e1', 'b1', 'c1', 100, '2025-01-01 10:00:00')",
+    "INSERT INTO transactions VALUES ('b1:e2', 'e2', 'b1', 'c2', 50, '2025-01-01 10:00:01')",
+    "INSERT INTO provisions VALUES ('p1', 'b1', 'c1', 50, 30, '2030-01-01 00:00:00', '2025-01-01 10:00:01')",
+]
+
+
+def test_upgrade_baseline_schema():
+    engine = make_engine(f"sqlite:///{os.path.join(DB_DIR, 'baseline.db')}")
+    with engine.begin() as conn:
+        for statement in BASELINE_DDL:
+            conn.exec_driver_sql(statement)
+
+    with engine.connect() as conn:
+        pending = pending_upgrades(conn)
+    assert "transactions: append-only ledger (seq primary key, kind, reverses_txn_id)" in pending
+    assert "provisions: status column" in pending
+
+    upgrade_schema(engine)
+    with engine.connect() as conn:
+        assert [upgrade for upgrade in pending_upgrades(conn) if not upgrade.endswith("new table")] == []
+        assert inspect(conn).get_pk_constraint("transactions")["constrained_columns"] == ["seq"]
+        assert conn.execute(text("SELECT seq, txn_id, kind FROM transactions ORDER BY seq")).all() == [
+            (1, "e1", "earn"), (2, "e2", "earn"), (3, "r1", "redeem")
+        ]
+        assert conn.execute(text("SELECT status FROM provisions")).scalar() == "active"
+    assert upgrade_schema(engine) == []
+    engine.dispose()
+
+
+def test_upgrade_outbox_to_autoincrement():
+    engine = make_engine(f"sqlite:///{os.path.join(DB_DIR, 'outbox.db')}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("""CREATE TABLE outbox_events (
+            id INTEGER NOT NULL, brand_id VARCHAR NOT NULL, event_type VARCHAR NOT NULL, payload TEXT NOT NULL,
+            created_at DATETIME, PRIMARY KEY (id))""")
+        conn.exec_driver_sql("CREATE INDEX idx_outbox_brand_id ON outbox_events (brand_id, id)")
+        conn.exec_driver_sql("INSERT INTO outbox_events VALUES (7, 'b1', 'earned', '{}', '2025-01-01 10:00:00')")
+
+    with engine.connect() as conn:
+        assert "outbox_events: AUTOINCREMENT ids (SQLite)" in pending_upgrades(conn)
+    upgrade_schema(engine)
+    with engine.begin() as conn:
+        assert "outbox_events: AUTOINCREMENT ids (SQLite)" not in pending_upgrades(conn)
+        assert conn.execute(text("SELECT id, brand_id FROM outbox_events")).all() == [(7, "b1")]
+        conn.exec_driver_sql("DELETE FROM outbox_events")
+        conn.exec_driver_sql("INSERT INTO outbox_events (brand_id, event_type, payload) VALUES ('b1', 'earned', '{}')")
+        assert conn.execute(text("SELECT id FROM outbox_events")).scalar() == 8
+    engine.dispose()
@@ -0,0 +1,75 @@
+"""Statement and commit budgets of the hot routes (default configuration)
+
+Counted without webhooks, Idempotency-Key or group commit: each adds
+statements (an outbox row, the stored replay, the batch's savepoints).
+"""
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.core.query_budget import clear_query_budgets, declare_query_budget
+
+BRAND_ID = "brand-001"  # Seeded by development startup
+
+BUDGETS = [
+    # method, route, queries, commits
+    ("POST", "/brands/{brand_id}/customers", 7, 1),
+    ("POST", "/brands/{brand_id}/earn", 4, 1),
+    ("POST", "/brands/{brand_id}/earn/batch", 8, 1),  # Whatever the batch size
+    ("POST", "/brands/{brand_id}/provision", 4, 1),  # Guarded deductions fold shards first
+    ("POST", "/brands/{brand_id}/redeem", 6, 1),
+    ("POST", "/brands/{brand_id}/void", 4, 1),
+    ("GET", "/provisions/{provision_id}", 1, 0),
+    ("GET", "/brands/{brand_id}/customers/{customer_id}/balance", 1, 0),
+    ("GET", "/brands/{brand_id}/customers/{brand_customer_id}", 2, 0),
+    ("GET", "/brands/{brand_id}/customers", 1, 0),
+    ("GET", "/brands/{brand_id}/customers/{customer_id}/transactions", 1, 0),
+]
+
+
+@pytest.fixture
+def client():
+    for method, route, queries, commits in BUDGETS:
+        declare_query_budget(method, route, queries=queries, commits=commits)
+    try:
+        with TestClient(main.app) as client:
+            yield client
+    finally:
+        clear_query_budgets()
+
+
+def call(client, method, path, **kwargs):
+    """A request that stayed within its budget (QueryBudgetExceeded propagates otherwise)"""
+    response = client.request(method, path, **kwargs)
+    assert response.status_code < 300, response.text
+    assert "x-db-n-plus-one" not in response.headers
+    return response
+
+
+def test_hot_routes_stay_within_their_query_budgets(client):
+    for customer_id, phone in (("QB-A", "5559990001"), ("QB-B", "5559990002")):
+        call(client, "POST", f"/brands/{BRAND_ID}/customers", json={"phoneNumber": phone, "brandCustomerId": customer_id})
+
+    earn = call(client, "POST", f"/brands/{BRAND_ID}/earn", json={"txnId": "qb-1", "customerId": "QB-A", "points": 100})
+    assert earn.headers["x-db-commits"] == "1"
+    call(client, "POST", f"/brands/{BRAND_ID}/earn", json={"txnId": "qb-2", "customerId": "QB-A", "points": 100})
+    for size in (2, 200):
+        items = [{"txnId": f"qb-batch-{size}-{i}", "customerId": ("QB-A", "QB-B")[i % 2], "points": 1}
+                 for i in range(size)]
+        call(client, "POST", f"/brands/{BRAND_ID}/earn/batch", json={"items": items})
+
+    expires_at = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    call(client, "POST", f"/brands/{BRAND_ID}/provision",
+         json={"provisionId": "qb-p1", "customerId": "QB-A", "points": 50, "expiresAt": expires_at})
+    call(client, "GET", "/provisions/qb-p1")
+    call(client, "POST", f"/brands/{BRAND_ID}/redeem",
+         json={"provisionId": "qb-p1", "customerId": "QB-A", "points": 20, "txnId": "qb-r1"})
+    call(client, "POST", f"/brands/{BRAND_ID}/void", json={"txnId": "qb-1"})
+
+    balance = call(client, "GET", f"/brands/{BRAND_ID}/customers/QB-A/balance").json()
+    assert balance["points"] == 100 + 101 - 50  # qb-1 voided, the provision's 50 taken out
+    call(client, "GET", f"/brands/{BRAND_ID}/customers/QB-A")
+    call(client, "GET", f"/brands/{BRAND_ID}/customers")
+    call(client, "GET", f"/brands/{BRAND_ID}/customers/QB-A/transactions")
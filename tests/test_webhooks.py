@@ -0,0 +1,65 @@
+import asyncio
+
+from app.core.config import settings
+from app.core.crud import JobLeaseCRUD, OutboxCRUD
+from app.core.webhooks import WebhookDispatcher
+
+from conftest import in_transaction
+
+BRAND_ID = "brand-hooks"
+
+
+class Receiver:
+    """Records the event ids of each posted batch, like a webhook endpoint that de-duplicates"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def post(self, url, json, headers):
+        self.batches.append([event["data"]["n"] for event in json["events"]])
+        return type("Response", (), {"status_code": 204})()
+
+
+def make_dispatcher(receiver: Receiver) -> WebhookDispatcher:
+    dispatcher = WebhookDispatcher(batch_size=2, timeout_seconds=1, max_backoff_seconds=1)
+    dispatcher._client = receiver
+    return dispatcher
+
+
+def drain(dispatcher: WebhookDispatcher) -> None:
+    while asyncio.run(dispatcher.dispatch_once()):
+        pass
+
+
+def test_events_queued_after_the_outbox_drains_are_delivered(monkeypatch):
+    monkeypatch.setitem(settings.WEBHOOK_URLS, BRAND_ID, "http://receiver.test/hooks")
+    receiver = Receiver()
+    dispatcher = make_dispatcher(receiver)
+    for round_start in (0, 2, 4):
+        for n in (round_start, round_start + 1):
+            in_transaction(OutboxCRUD.add, BRAND_ID, "earned", {"n": n})
+        drain(dispatcher)
+
+    assert receiver.batches == [[0, 1], [2, 3], [4, 5]]
+    assert in_transaction(OutboxCRUD.get_batch, BRAND_ID, 10) == []
+
+
+def test_only_the_lease_holder_dispatches(monkeypatch):
+    monkeypatch.setitem(settings.WEBHOOK_URLS, BRAND_ID, "http://receiver.test/hooks")
+    in_transaction(OutboxCRUD.add, BRAND_ID, "earned", {"n": 0})
+    in_transaction(JobLeaseCRUD.acquire, "webhook dispatch", "other worker", 60)
+    receiver = Receiver()
+    dispatcher = make_dispatcher(receiver)
+
+    async def run_briefly():
+        try:
+            await asyncio.wait_for(dispatcher.run(0.01), timeout=0.2)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run_briefly())
+    assert receiver.batches == [] and dispatcher.skipped > 0
+
+    in_transaction(JobLeaseCRUD.acquire, "webhook dispatch", "other worker", -1)  # The other worker stops
+    asyncio.run(run_briefly())
+    assert receiver.batches == [[0]]